@@ -0,0 +1,143 @@
+"""
+All-pairs distance table for a map file.
+Authors: Christopher Jens Johnson
+
+Computes the shortest distance between every pair of places on a map by
+running dijkstra() from each place, spread over a pool of worker processes.
+The graph is never pickled: each worker memory-maps the compiled map cache
+written by graphcache.load_graph(), so all workers share the same pages of
+the operating system's file cache. When that cache cannot be written next
+to the map (e.g. a read-only directory), the parent writes one to a
+temporary directory for the workers instead; they never parse the map. Workers also write their rows straight
+into the memory-mapped output file, so only row numbers travel between
+processes.
+
+The table is written in NumPy's .npy format (a float64 or float32 matrix,
+readable with numpy.load(output, mmap_mode='r')), with row/column i
+belonging to the i-th place name in output + '.names'. Unreachable pairs
+hold inf. Note that the table takes 8 * places**2 bytes (4 with --float32).
+
+Usage:
+
+python3 allpairs.py map_file output.npy [--workers N] [--float32]
+"""
+
+import argparse
+import mmap
+import multiprocessing
+import os
+import tempfile
+from array import array
+
+from dfs import dijkstra
+from graphcache import CACHE_SUFFIX, load_graph, read_cache, source_digest, write_cache
+
+ROWS_PER_TASK = 16
+
+_graph = None
+_table = None
+
+
+def npy_header(rows, columns, typecode):
+    """Header of a version 1.0 .npy file holding a C-order float matrix.
+    Args:
+        rows, columns: shape of the matrix
+        typecode: 'd' for float64 or 'f' for float32
+    Returns:
+        bytes, padded so the data that follows starts on a 64 byte boundary
+    """
+    descr = '<f8' if typecode == 'd' else '<f4'
+    header = "{{'descr': '{}', 'fortran_order': False, 'shape': ({}, {}), }}".format(
+        descr, rows, columns)
+    prefix_size = 10    # magic string, version, header length
+    padding = -(prefix_size + len(header) + 1) % 64
+    header = (header + " " * padding + "\n").encode("latin1")
+    return b"\x93NUMPY\x01\x00" + len(header).to_bytes(2, "little") + header
+
+
+def _init_worker(cache_path, node_count, output_path, data_offset, typecode):
+    """Pool initializer: map the graph cache and the output table."""
+    global _graph, _table
+    cached = read_cache(cache_path)
+    # a failure is reported by _fill_rows: a pool whose initializer raises
+    # keeps starting new workers instead of failing
+    if cached is not None and cached[0].node_count == node_count:
+        _graph = cached[0]
+    output = open(output_path, "r+b")
+    buffer = mmap.mmap(output.fileno(), 0)
+    _table = memoryview(buffer)[data_offset:].cast(typecode)
+
+
+def _fill_rows(first_row):
+    """Pool task: compute and store rows first_row .. first_row+ROWS_PER_TASK-1."""
+    if _graph is None:
+        raise RuntimeError("worker could not map the graph cache")
+    count = _graph.node_count
+    last_row = min(first_row + ROWS_PER_TASK, count)
+    for source in range(first_row, last_row):
+        distances, previous = dijkstra(source, _graph)
+        _table[source * count:(source + 1) * count] = array(_table.format, distances)
+    return last_row - first_row
+
+
+def all_pairs(map_path, output_path, workers=None, typecode='d'):
+    """Write the all-pairs distance table for a map file.
+    Args:
+        map_path: name of a map file
+        output_path: name of the .npy file to write; place names are
+            written to output_path + '.names', one per line
+        workers: number of worker processes (default: one per CPU)
+        typecode: 'd' to store float64 distances, 'f' for float32
+    Returns:
+        number of places (rows) in the table
+    """
+    graph = load_graph(map_path)    # also makes sure the cache is up to date
+    count = graph.node_count
+    header = npy_header(count, count, typecode)
+    with open(output_path, "wb") as output:
+        output.write(header)
+        output.truncate(len(header) + array(typecode).itemsize * count * count)
+    with open(output_path + ".names", "w") as names:
+        for name in graph.names:
+            names.write(name + "\n")
+    if count == 0:
+        return 0
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        cache_path = map_path + CACHE_SUFFIX
+        cached = read_cache(cache_path)
+        if cached is None or cached[0].node_count != count:
+            # no usable cache next to the map: write one the workers can map
+            cache_path = os.path.join(work_dir, "map" + CACHE_SUFFIX)
+            write_cache(graph, cache_path, os.stat(map_path), source_digest(map_path))
+        with multiprocessing.Pool(workers, _init_worker,
+                                  (cache_path, count, output_path, len(header),
+                                   typecode)) as pool:
+            done = 0
+            for rows in pool.imap_unordered(_fill_rows, range(0, count, ROWS_PER_TASK)):
+                done += rows
+    return done
+
+
+def main():
+    """
+    Main program gets the map file and output file names and writes the
+    all-pairs distance table.
+    """
+    parser = argparse.ArgumentParser(
+        description="Compute distances between all pairs of places on a map")
+    parser.add_argument('map_file',
+                help = "Name of file containing road connections and distances")
+    parser.add_argument('output',
+                help = "Name of the .npy file to write the distance table to")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                help = "Number of worker processes (default: one per CPU)")
+    parser.add_argument('--float32', action='store_true',
+                help = "Store distances as float32 to halve the table size")
+    args = parser.parse_args()
+    rows = all_pairs(args.map_file, args.output, args.workers,
+                     'f' if args.float32 else 'd')
+    print("Wrote {0} x {0} distance table to {1}".format(rows, args.output))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""
+Benchmark harness for the shortest path tool.
+Authors: Christopher Jens Johnson
+
+For each map (generated by mapgen.py, or given with --map) this times:
+
+    parse       the line-by-line read_graph() and the chunked read_map()
+    cache       load_graph() building the binary cache, then loading it again
+    search      random point-to-point queries with each algorithm: full
+                dijkstra(), bidirectional Dijkstra, A* (when coordinates are
+                available) and the contraction hierarchy, whose one-off build
+                is timed separately as "preprocess"
+
+Peak Python memory of parsing and preprocessing is measured with tracemalloc
+in a separate run, so it does not distort the timings. Every algorithm's
+distance is checked against dijkstra()'s. Results are printed as a table and
+written as JSON, one record per (map, phase, algorithm), so that runs can be
+compared to spot regressions.
+
+Usage:
+
+python3 benchmark.py [--kinds grid,geometric] [--sizes 1000,10000]
+                     [--map map_file ...] [--queries 20] [--output results.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from dfs import dijkstra, INFINITY
+from roadgraph import read_graph
+from mapparser import read_map
+from graphcache import load_graph
+import contraction
+import mapgen
+import pointsearch
+
+
+def timed(function, *args):
+    """Call function(*args); return (result, seconds taken)."""
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def peak_memory(function, *args):
+    """Peak bytes allocated by Python while calling function(*args)."""
+    tracemalloc.start()
+    try:
+        function(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def read_graph_from(map_path):
+    with open(map_path, "r") as map_file:
+        return read_graph(map_file)
+
+
+def benchmark_map(name, map_path, coord_path, queries, measure_memory, rng):
+    """Run all phases on one map.
+    Returns:
+        list of result records (dicts)
+    """
+    records = [ ]
+
+    def record(phase, algorithm, seconds, **extra):
+        records.append(dict(map=name, phase=phase, algorithm=algorithm,
+                            seconds=seconds, **extra))
+
+    for algorithm, parse in ("read_graph", read_graph_from), ("read_map", read_map):
+        graph, seconds = timed(parse, map_path)
+        memory = peak_memory(parse, map_path) if measure_memory else None
+        record("parse", algorithm, seconds, peak_bytes=memory,
+               places=graph.node_count, roads=graph.edge_count // 2)
+
+    # map_path is in the benchmark's own directory, so there is no cache
+    # next to it yet and the first load builds one
+    graph, seconds = timed(load_graph, map_path)
+    record("cache", "build", seconds)
+    graph, seconds = timed(load_graph, map_path)
+    record("cache", "load", seconds)
+
+    hierarchy, seconds = timed(contraction.build_hierarchy, graph)
+    memory = peak_memory(contraction.build_hierarchy, graph) if measure_memory else None
+    record("preprocess", "ch", seconds, peak_bytes=memory,
+           shortcuts=len(hierarchy.targets) - graph.edge_count // 2)
+
+    coordinates = None
+    if coord_path is not None:
+        with open(coord_path, "r") as coord_file:
+            coordinates = pointsearch.read_coordinates(coord_file, graph)
+
+    pairs = [ (rng.randrange(graph.node_count), rng.randrange(graph.node_count))
+              for query in range(queries) ] if graph.node_count else [ ]
+    expected = [ ]
+    searches = { "dijkstra": [ ], "bidirectional": [ ], "ch": [ ] }
+    if coordinates:
+        searches["astar"] = [ ]
+    for source, target in pairs:
+        (distances, previous), seconds = timed(dijkstra, source, graph)
+        expected.append(distances[target])
+        searches["dijkstra"].append((distances[target], seconds,
+                                     sum(1 for dist in distances if dist < INFINITY)))
+        result, seconds = timed(pointsearch.bidirectional_dijkstra, graph, source, target)
+        searches["bidirectional"].append((result[0], seconds, result[2]))
+        result, seconds = timed(hierarchy.query, source, target)
+        searches["ch"].append((result[0], seconds, result[2]))
+        if coordinates:
+            heuristic = pointsearch.euclidean_heuristic(coordinates, target)
+            result, seconds = timed(pointsearch.astar, graph, source, target, heuristic)
+            searches["astar"].append((result[0], seconds, result[2]))
+
+    for algorithm, results in searches.items():
+        if not results:
+            continue
+        mismatches = sum(1 for (distance, seconds, explored), want
+                         in zip(results, expected) if abs(distance - want) > 1e-6 * max(1.0, want)
+                         and not (distance == want == INFINITY))
+        record("search", algorithm,
+               sum(seconds for distance, seconds, explored in results) / len(results),
+               explored=sum(explored for distance, seconds, explored in results) / len(results),
+               queries=len(results), mismatches=mismatches)
+    return records
+
+
+def print_table(records):
+    print("{:<24} {:<10} {:<14} {:>10} {:>12} {:>10}".format(
+        "map", "phase", "algorithm", "seconds", "peak MiB", "explored"))
+    for rec in records:
+        peak = rec.get("peak_bytes")
+        print("{:<24} {:<10} {:<14} {:>10.4f} {:>12} {:>10}".format(
+            rec["map"], rec["phase"], rec["algorithm"], rec["seconds"],
+            "" if peak is None else "{:.1f}".format(peak / (1 << 20)),
+            "" if "explored" not in rec else "{:.0f}".format(rec["explored"])))
+
+
+def main():
+    """
+    Main program generates the maps, runs the benchmarks and writes results.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the shortest path tool")
+    parser.add_argument('--kinds', default="grid,geometric,scalefree",
+                help = "Comma separated kinds of generated maps (see mapgen.py)")
+    parser.add_argument('--sizes', default="1000,10000",
+                help = "Comma separated numbers of places of generated maps")
+    parser.add_argument('--map', action='append', default=[ ],
+                help = "Benchmark this existing map file too (repeatable); "
+                       "'map_file:coord_file' also benchmarks A*")
+    parser.add_argument('--queries', type=int, default=20,
+                help = "Random queries per map and algorithm")
+    parser.add_argument('--seed', type=int, default=210,
+                help = "Random seed for generated maps and queries")
+    parser.add_argument('--no-memory', action='store_true',
+                help = "Skip the (slow) peak memory measurements")
+    parser.add_argument('--output', default="benchmark_results.json",
+                help = "JSON file to write the results to")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    records = [ ]
+    with tempfile.TemporaryDirectory() as work_dir:
+        maps = [ ]
+        for kind in filter(None, args.kinds.split(",")):
+            for size in filter(None, args.sizes.split(",")):
+                name = "{}-{}".format(kind, size)
+                map_path = os.path.join(work_dir, name + ".txt")
+                coord_path = os.path.join(work_dir, name + ".coords")
+                located, roads = mapgen.write_map(map_path, kind, int(size),
+                                                  args.seed, coord_path)
+                maps.append((name, map_path, coord_path if located else None))
+        for number, given in enumerate(args.map):
+            # benchmark a copy, so the caches built next to it are the
+            # benchmark's own and the user's are left alone
+            given_path, _, coord_path = given.partition(":")
+            map_path = os.path.join(work_dir, "given-{}-{}".format(
+                number, os.path.basename(given_path)))
+            shutil.copyfile(given_path, map_path)
+            maps.append((os.path.basename(given_path), map_path, coord_path or None))
+
+        for name, map_path, coord_path in maps:
+            records.extend(benchmark_map(name, map_path, coord_path, args.queries,
+                                         not args.no_memory, rng))
+
+    print_table(records)
+    with open(args.output, "w") as output:
+        json.dump({"python": platform.python_version(),
+                   "machine": platform.machine(),
+                   "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                   "seed": args.seed,
+                   "results": records}, output, indent=1)
+    print("Results written to", args.output)
+
+if __name__ == "__main__":
+    main()
@@ -4,12 +4,23 @@ Authors: Christopher Jens Johnson
 Credit: Concept by Professor Joe Sventek, Computer Science 210 at University of Oregon
 
 
-Simple depth first search algorithm that reads a "map", or text file containing distances between
+Shortest path search that reads a "map", or text file containing distances between
 various places, and determines the shortest distance between two specified places.
+The original recursive depth first search re-explored every neighbor each time it
+found a shorter distance to a place; the search is now Dijkstra's algorithm with a
+binary heap, which settles each place once.
 
 Program executes on a command-line client in the format of:
 
-python3 dfs.py place_from place_to file
+python3 dfs.py place_from place_to file [--route]
+python3 dfs.py --batch query_file file
+python3 dfs.py place_from place_to file --algorithm bidirectional --stats
+python3 dfs.py place_from place_to file --algorithm astar --coords coord_file
+python3 dfs.py place_from place_to file --algorithm ch
+
+In batch mode query_file (or standard input, if it is -) holds one
+"place_from,place_to" pair per line; the results are written as
+"place_from,place_to,distance" lines.
 
 
 
@@ -30,6 +41,15 @@ place_three, place_four, distance
 """
 
 import argparse 
+import heapq
+import itertools
+import sys
+from graphcache import load_graph
+import pointsearch
+import contraction
+
+INFINITY = float('inf')
+BATCH_CHUNK = 10000     # queries grouped by start place at a time in batch mode
 
 
 def read_distances(map_file):
@@ -86,30 +106,146 @@ def show_roads(roads):
     print(show_roads(roads))
             
 
-def dfs(place, dist_so_far, roads, distances):
-    """Depth-first search, which may continue from from_place if dist_so_far    
-        is the shortest distance at which it has yet been reached.  
-       Args: 
-          place: Currently searching from here
-          dist_so_far:  Distance at which from_place has been reached 
-              this time (which may not be the shortest path to from_place)
-          roads:  dict mapping places to lists of hops of the form (place, hop-distance)
-          distances: dict mapping places to the shortest distance at which they 
-               have been reached so far (up to this time). 
+def dijkstra(source, graph, wanted=None):
+    """Dijkstra's shortest path search from source, using a binary heap
+        as the priority queue.  Each place is settled exactly once, so the
+        search runs in O(E log V) time and never recurses.
+       Args:
+          source: Id of the place to search from
+          graph:  RoadGraph (see roadgraph.py); a dict built by
+              read_distances() can be converted with RoadGraph.from_roads()
+          wanted: optional collection of place ids; if given, the search
+              stops as soon as all of them are settled, so distances of
+              other places may be left too large or at INFINITY
+       Returns:
+          Tuple (distances, previous) of lists indexed by place id, where
+          distances[node] is the shortest distance from source to node
+          (INFINITY if node cannot be reached) and previous[node] is the id of
+          the place node is reached from on a shortest path (-1 for source
+          and for unreached places).
     """
-    if place not in distances:  
-        distances[place] = dist_so_far
-        for i in roads[place]:
-            dfs(i[0], dist_so_far + i[1], roads, distances)
-    if place in distances:
-        if dist_so_far < distances[place]:
-            distances[place] = dist_so_far
-            for i in roads[place]:
-                dfs(i[0], dist_so_far + i[1], roads, distances) 
-    return
-            
+    offsets = graph.offsets
+    targets = graph.targets
+    weights = graph.weights
+    distances = [INFINITY] * graph.node_count
+    previous = [-1] * graph.node_count
+    settled = bytearray(graph.node_count)
+    distances[source] = 0.0
+    remaining = None if wanted is None else set(wanted)
+    frontier = [ (0.0, source) ]
+    while frontier:
+        dist_so_far, node = heapq.heappop(frontier)
+        if settled[node]:
+            continue    # stale heap entry, node was settled at a shorter distance
+        settled[node] = 1
+        if remaining is not None:
+            remaining.discard(node)
+            if not remaining:
+                break
+        for i in range(offsets[node], offsets[node + 1]):
+            to_node = targets[i]
+            dist = dist_so_far + weights[i]
+            if dist < distances[to_node]:
+                distances[to_node] = dist
+                previous[to_node] = node
+                heapq.heappush(frontier, (dist, to_node))
+    return distances, previous
+
+
+def find_route(previous, source, destination):
+    """Rebuild the route found by dijkstra().
+       Args:
+          previous: list of predecessor ids, as returned by dijkstra()
+          source: Id of the place the search started from
+          destination: Id of the place to route to
+       Returns:
+          List of place ids from source to destination, inclusive, or
+          None if destination was not reached.
+    """
+    if destination != source and previous[destination] < 0:
+        return None
+    route = [destination]
+    while route[-1] != source:
+        route.append(previous[route[-1]])
+    route.reverse()
+    return route
+
+
+def read_queries(query_file):
+    """Read route queries, one "from place,to place" pair per line.
+       Blank lines and lines starting with # are skipped, as in map files.
+       Args:
+          query_file: readable text file (or any iterable of lines)
+       Returns:
+          generator of (from place, to place) pairs
+    """
+    for line in query_file:
+        line = line.strip()
+        if line.startswith("#") or line == "":
+            continue
+        fields = line.split(",")
+        yield fields[0], fields[1]
+
+
+def run_batch(graph, queries, out, chunk_size=BATCH_CHUNK):
+    """Answer many route queries with one search per distinct start place.
+       Queries are taken chunk_size at a time and grouped by start place;
+       each group is answered by a single dijkstra() run that stops once all
+       of the group's destinations are settled, and its results are written
+       before the next group is searched.
+       Args:
+          graph: RoadGraph to search
+          queries: iterable of (from place, to place) pairs
+          out: writable text file; one "from,to,distance" line is written per
+              query (distance is inf if there is no route) in the order the
+              groups are searched
+          chunk_size: number of queries grouped together at a time
+       Returns:
+          number of queries that named a place not on the map (these are
+          reported on standard error and produce no output line)
+    """
+    unknown = 0
+    queries = iter(queries)
+    while True:
+        groups = { }
+        for start_place, destination in itertools.islice(queries, chunk_size):
+            groups.setdefault(start_place, [ ]).append(destination)
+        if not groups:
+            return unknown
+        for start_place, destinations in groups.items():
+            missing = [place for place in [start_place] + destinations
+                       if place not in graph]
+            for place in missing:
+                print("Place", place, "is not on the map", file=sys.stderr)
+            if start_place not in graph:
+                unknown += len(destinations)
+                continue
+            known = [place for place in destinations if place in graph]
+            unknown += len(destinations) - len(known)
+            wanted = [graph.id_of(place) for place in known]
+            distances, previous = dijkstra(graph.id_of(start_place), graph, wanted)
+            for destination, target in zip(known, wanted):
+                out.write("{},{},{}\n".format(
+                    start_place, destination, distances[target]))
+            out.flush()
+
+
+class MapErrorReport(list):
+
+    """List of map file errors for load_graph() that also reports each one
+    on standard error as it is found (only the first MAX_REPORTED of them).
+    """
+
+    MAX_REPORTED = 20
+
+    def append(self, error):
+        super().append(error)
+        if len(self) <= self.MAX_REPORTED:
+            print("Map file line {}: {}".format(*error), file=sys.stderr)
+        elif len(self) == self.MAX_REPORTED + 1:
+            print("(further map file errors not shown)", file=sys.stderr)
+
 
-    
 def main():
     """
     Main program gets city pair and map file name,
@@ -117,33 +253,95 @@ def main():
     """
     parser = argparse.ArgumentParser(
         description="Find shortest route in road network")
-    parser.add_argument('from_place', 
+    parser.add_argument('from_place', nargs='?',
                 help = "Starting place (quoted if it contains blanks)")
-    parser.add_argument('to_place', 
+    parser.add_argument('to_place', nargs='?',
                 help = "Destination place (quoted if it contains blanks)")
-    parser.add_argument('map_file', type=argparse.FileType('r'),
+    parser.add_argument('map_file', 
                 help = "Name of file containing road connections and distances")
+    parser.add_argument('--route', action='store_true',
+                help = "Also print the places along the shortest route")
+    parser.add_argument('--no-cache', action='store_true',
+                help = "Parse the map file even if a compiled copy "
+                       "(map_file.graph) is up to date, and do not write one")
+    parser.add_argument('--batch', metavar='QUERY_FILE', type=argparse.FileType('r'),
+                help = "Answer every 'from,to' pair in QUERY_FILE ('-' for "
+                       "standard input) instead of a single from_place/to_place")
+    parser.add_argument('--algorithm', default='dijkstra',
+                choices=['dijkstra', 'bidirectional', 'astar', 'ch'],
+                help = "Search used for a single query: full single-source "
+                       "Dijkstra (default), bidirectional Dijkstra, A*, or "
+                       "a contraction hierarchy (built once and saved as "
+                       "map_file.ch; the build can take minutes on large "
+                       "maps that are not road-like)")
+    parser.add_argument('--coords', metavar='COORD_FILE', type=argparse.FileType('r'),
+                help = "File of 'place,x,y' lines used by the A* heuristic")
+    parser.add_argument('--great-circle', action='store_true',
+                help = "Coordinates are 'place,latitude,longitude' in degrees; "
+                       "use great-circle miles as the A* heuristic")
+    parser.add_argument('--heuristic-scale', type=float, default=1.0,
+                help = "Map distance per unit of coordinate distance; must "
+                       "not overestimate, or A* routes may not be shortest")
+    parser.add_argument('--stats', action='store_true',
+                help = "Report how many places the search explored")
     args = parser.parse_args()
+    if (args.batch is None) != (args.to_place is not None):
+        parser.error("give either from_place and to_place, or --batch")
+    try:
+        graph = load_graph(args.map_file, use_cache=not args.no_cache,
+                           errors=MapErrorReport())
+    except OSError as err:
+        # reported as argparse.FileType would, as before the map cache
+        parser.error("argument map_file: can't open '{}': {}".format(args.map_file, err))
+    if args.batch is not None:
+        unknown = run_batch(graph, read_queries(args.batch), sys.stdout)
+        exit(1 if unknown else 0)
+
     start_place  = args.from_place
     destination = args.to_place
-    roads = read_distances(args.map_file)
 
-    if not start_place in roads: 
+    if not start_place in graph: 
         print("Start place ", start_place, " is not on the map")
         exit(1)
-    if not destination in roads: 
+    if not destination in graph: 
         print("Destination ", destination, " is not on the map")
         exit(1)
 
-    distances = { }
-
-    dfs(start_place, 0.0, roads, distances )
+    source = graph.id_of(start_place)
+    target = graph.id_of(destination)
+    if args.algorithm == 'bidirectional':
+        distance, route, explored = pointsearch.bidirectional_dijkstra(
+            graph, source, target)
+    elif args.algorithm == 'ch':
+        hierarchy = contraction.load_hierarchy(args.map_file, graph)
+        distance, route, explored = hierarchy.query(source, target)
+    elif args.algorithm == 'astar':
+        if args.coords is None:
+            parser.error("--algorithm astar needs --coords")
+        coordinates = pointsearch.read_coordinates(args.coords, graph)
+        if args.great_circle:
+            heuristic = pointsearch.great_circle_heuristic(
+                coordinates, target, args.heuristic_scale)
+        else:
+            heuristic = pointsearch.euclidean_heuristic(
+                coordinates, target, args.heuristic_scale)
+        distance, route, explored = pointsearch.astar(
+            graph, source, target, heuristic)
+    else:
+        distances, previous = dijkstra(source, graph)
+        distance = distances[target]
+        route = find_route(previous, source, target)
+        explored = sum(1 for dist in distances if dist < INFINITY)
 
-    if destination in distances :
+    if distance < INFINITY :
         print("Distance from {} to {} is {}".format(
-            start_place,destination, distances[destination]))
+            start_place,destination, distance))
+        if args.route:
+            print("Route: " + " -> ".join(graph.name_of(node) for node in route))
     else:
         print("You can't get from {} to {}".format(start_place, destination))
+    if args.stats:
+        print("Explored {} of {} places".format(explored, graph.node_count))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,255 @@
+"""
+Road changes on a loaded map, with incremental shortest path repair.
+Authors: Christopher Jens Johnson
+
+A RoadGraph (see roadgraph.py) is a set of read-only arrays, possibly
+memory-mapped from a cache file. DynamicGraph layers changes on top of one:
+roads can be added, closed or have their cost changed, and new places can
+appear, without rebuilding the arrays. Every change of the cost of getting
+between two places is announced to the functions registered with
+add_listener(), as listener(node, other, old_cost, new_cost), with inf
+standing for a missing road; each ShortestPathTree registers its
+road_changed() method this way to keep its routes up to date.
+
+ShortestPathTree keeps the result of a single-source search (distances and
+the tree of predecessors) for a DynamicGraph and repairs it when a road
+changes instead of searching again from scratch:
+
+    a road gets cheaper    only places whose distance improves through the
+                           road are touched, by a Dijkstra search seeded
+                           with the road's two ends
+    a road gets dearer     only the subtree hanging from the road, if it is
+    (or is closed)         a tree road, is affected; those places are
+                           reset and re-attached from their neighbors
+                           outside the subtree, then settled by a Dijkstra
+                           search restricted to them
+
+Usage:
+
+    roads = DynamicGraph(load_graph("cities.txt"))
+    tree = ShortestPathTree(roads, roads.id_of("Denver"))
+    roads.set_road("Kansas City", "Dallas", 700.0)    # tree is repaired
+    roads.remove_road("Denver", "Omaha")
+    print(tree.distances[roads.id_of("Dallas")])
+"""
+
+import heapq
+
+from roadgraph import RoadGraph
+
+INFINITY = float('inf')
+
+
+class DynamicGraph:
+
+    """A RoadGraph plus a set of changed roads.
+    Public data attributes:
+        base: the RoadGraph the changes apply to
+        names: list of place names, including places added since loading
+        index: dict mapping place names to ids
+        listeners: functions called as listener(node, other, old_cost,
+            new_cost) after the road between places node and other changes;
+            a missing road has cost INFINITY
+
+    Between two places there is at most one road after a change: set_road()
+    replaces all the roads the map file had between them.
+    """
+
+    def __init__(self, graph):
+        self.base = graph
+        self.names = list(graph.names)
+        self.index = dict(graph.index)
+        self.changed = { }      # node -> { neighbor: cost, or None if closed }
+        self.listeners = [ ]
+
+    @property
+    def node_count(self):
+        return len(self.names)
+
+    def __contains__(self, place):
+        return place in self.index
+
+    def id_of(self, place):
+        """Id of the named place (KeyError if it is not on the map)."""
+        return self.index[place]
+
+    def name_of(self, node):
+        """Name of the place with id node."""
+        return self.names[node]
+
+    def add_listener(self, listener):
+        """Call listener(node, other, old_cost, new_cost) on every road change."""
+        self.listeners.append(listener)
+
+    def neighbors(self, node):
+        """Iterate over the roads leaving node as (target id, cost) pairs."""
+        overlay = self.changed.get(node)
+        if node < self.base.node_count:
+            for target, cost in self.base.neighbors(node):
+                if overlay is None or target not in overlay:
+                    yield target, cost
+        if overlay is not None:
+            for target, cost in overlay.items():
+                if cost is not None:
+                    yield target, cost
+
+    def cost(self, node, other):
+        """Cost of the cheapest road between node and other, or INFINITY."""
+        return min((cost for target, cost in self.neighbors(node)
+                    if target == other), default=INFINITY)
+
+    def add_place(self, place):
+        """Id of place, adding it (with no roads) if it is not on the map."""
+        if place not in self.index:
+            self.index[place] = len(self.names)
+            self.names.append(place)
+        return self.index[place]
+
+    def set_road(self, place_from, place_to, cost):
+        """Add the road place_from-place_to, or change its cost.
+        Args:
+            place_from, place_to: place names; places not yet on the map
+                are added
+            cost: new cost of the road (a non-negative float), or None to
+                close the road
+        Effects:
+            notifies the listeners if the cost of getting from one place to
+            the other directly has changed
+        """
+        node = self.add_place(place_from)
+        other = self.add_place(place_to)
+        old_cost = self.cost(node, other)
+        self.changed.setdefault(node, { })[other] = cost
+        self.changed.setdefault(other, { })[node] = cost
+        new_cost = INFINITY if cost is None else cost
+        if new_cost != old_cost:
+            for listener in self.listeners:
+                listener(node, other, old_cost, new_cost)
+
+    def remove_road(self, place_from, place_to):
+        """Close the road(s) between two places."""
+        self.set_road(place_from, place_to, None)
+
+    def compact(self):
+        """Fold the changes into a new RoadGraph, e.g. to save or to run
+        the searches that need CSR arrays."""
+        sources = [ ]
+        targets = [ ]
+        weights = [ ]
+        for node in range(self.node_count):
+            for target, cost in self.neighbors(node):
+                sources.append(node)
+                targets.append(target)
+                weights.append(cost)
+        return RoadGraph.from_edges(list(self.names), sources, targets, weights)
+
+
+class ShortestPathTree:
+
+    """Shortest distances and routes from one place, kept up to date as
+    the roads of a DynamicGraph change.
+    Public data attributes (read only):
+        source: id of the place the routes start from
+        distances: list, distances[node] is the shortest distance from
+            source to node, INFINITY if node cannot be reached
+        parents: list, parents[node] is the place before node on its
+            shortest route (-1 for source and unreached places)
+    """
+
+    def __init__(self, graph, source):
+        self.graph = graph
+        self.source = source
+        self.recompute()
+        graph.add_listener(self.road_changed)
+
+    def recompute(self):
+        """Rebuild the tree with a full Dijkstra search."""
+        count = self.graph.node_count
+        self.distances = [INFINITY] * count
+        self.parents = [-1] * count
+        self.children = [ set() for node in range(count) ]
+        self.distances[self.source] = 0.0
+        self._settle([ (0.0, self.source) ])
+
+    def route_to(self, target):
+        """List of place ids from source to target, or None if unreachable."""
+        self._grow()
+        if self.distances[target] == INFINITY:
+            return None
+        route = [target]
+        while route[-1] != self.source:
+            route.append(self.parents[route[-1]])
+        route.reverse()
+        return route
+
+    def _grow(self):
+        """Make room for places added to the graph since the last change."""
+        added = self.graph.node_count - len(self.distances)
+        if added > 0:
+            self.distances.extend([INFINITY] * added)
+            self.parents.extend([-1] * added)
+            self.children.extend(set() for node in range(added))
+
+    def _set_parent(self, node, parent):
+        old_parent = self.parents[node]
+        if old_parent >= 0:
+            self.children[old_parent].discard(node)
+        self.parents[node] = parent
+        if parent >= 0:
+            self.children[parent].add(node)
+
+    def _settle(self, frontier, allowed=None):
+        """Dijkstra search from the (distance, node) entries in frontier,
+        improving distances of places in allowed (all places if None)."""
+        heapq.heapify(frontier)
+        distances = self.distances
+        while frontier:
+            dist_so_far, node = heapq.heappop(frontier)
+            if dist_so_far > distances[node]:
+                continue    # stale heap entry
+            for target, cost in self.graph.neighbors(node):
+                dist = dist_so_far + cost
+                if dist < distances[target] and (allowed is None or target in allowed):
+                    distances[target] = dist
+                    self._set_parent(target, node)
+                    heapq.heappush(frontier, (dist, target))
+
+    def road_changed(self, node, other, old_cost, new_cost):
+        """DynamicGraph listener: repair the tree after a road change."""
+        self._grow()
+        if new_cost < old_cost:
+            frontier = [ ]
+            for near, far in (node, other), (other, node):
+                dist = self.distances[near] + new_cost
+                if dist < self.distances[far]:
+                    self.distances[far] = dist
+                    self._set_parent(far, near)
+                    frontier.append((dist, far))
+            self._settle(frontier)
+        else:
+            for near, far in (node, other), (other, node):
+                if self.parents[far] == near:
+                    self._reattach_subtree(far)
+
+    def _reattach_subtree(self, root):
+        """Recompute distances of root and its descendants after the road
+        from root to its parent got dearer or was closed."""
+        subtree = set()
+        pending = [root]
+        while pending:
+            node = pending.pop()
+            subtree.add(node)
+            pending.extend(self.children[node])
+        for node in subtree:
+            self.distances[node] = INFINITY
+            self._set_parent(node, -1)
+
+        frontier = [ ]
+        for node in subtree:
+            for target, cost in self.graph.neighbors(node):
+                if target not in subtree and self.distances[target] + cost < self.distances[node]:
+                    self.distances[node] = self.distances[target] + cost
+                    self._set_parent(node, target)
+            if self.distances[node] < INFINITY:
+                frontier.append((self.distances[node], node))
+        self._settle(frontier, subtree)
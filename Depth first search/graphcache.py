@@ -0,0 +1,159 @@
+"""
+Persistent binary cache of parsed map files.
+Authors: Christopher Jens Johnson
+
+Parsing a large map file with read_graph() means tokenizing millions of
+lines on every query. load_graph() instead compiles the map once into a
+binary file stored next to it (map_file + CACHE_SUFFIX), and later calls
+memory-map that file and use the CSR arrays in place, without copying them.
+
+Cache file layout (little-endian):
+
+    header      HEADER struct, see below
+    offsets     node_count+1 int64
+    targets     edge_count int32, zero padded to a multiple of 8 bytes
+    weights     edge_count float64
+    names       place names, UTF-8, separated by newlines
+
+The header records the size, modification time and SHA-1 digest of the map
+file it was built from. A cache whose size and mtime match is used directly;
+if only the mtime differs the map file is hashed, and the cache is kept (with
+the new mtime) when the digest still matches, otherwise it is rebuilt.
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+
+from roadgraph import RoadGraph
+from mapparser import read_map
+
+CACHE_SUFFIX = ".graph"
+# bumped whenever the layout or what mapparser makes of a map file changes,
+# so caches built by an older version are rebuilt
+MAGIC = b"RGRAPH03"
+
+# magic, node_count, edge_count, names_size, source size, source mtime (ns), source sha1
+HEADER = struct.Struct("<8sqqqqq20s4x")
+
+
+def source_digest(path):
+    """SHA-1 digest of the file at path, read in 1 MiB blocks."""
+    digest = hashlib.sha1()
+    with open(path, "rb") as source:
+        for block in iter(lambda: source.read(1 << 20), b""):
+            digest.update(block)
+    return digest.digest()
+
+
+def write_cache(graph, cache_path, source_stat, digest):
+    """Write graph to cache_path in the layout described above.
+    Args:
+        graph: RoadGraph to store
+        cache_path: name of the cache file to (over)write
+        source_stat: os.stat_result of the map file graph was read from
+        digest: SHA-1 digest of the map file
+    Effects:
+        writes to a temporary file and renames it over cache_path, so a
+        concurrent reader never sees a partial cache
+    """
+    names = "\n".join(graph.names).encode("utf-8")
+    header = HEADER.pack(MAGIC, graph.node_count, graph.edge_count,
+                         len(names), source_stat.st_size,
+                         source_stat.st_mtime_ns, digest)
+    temp_path = "{}.{}.tmp".format(cache_path, os.getpid())
+    with open(temp_path, "wb") as cache:
+        cache.write(header)
+        cache.write(memoryview(graph.offsets).cast("B"))
+        targets = memoryview(graph.targets).cast("B")
+        cache.write(targets)
+        cache.write(bytes(-len(targets) % 8))
+        cache.write(memoryview(graph.weights).cast("B"))
+        cache.write(names)
+    os.replace(temp_path, cache_path)
+
+
+def read_cache(cache_path):
+    """Memory-map a cache file written by write_cache().
+    Returns:
+        Tuple (graph, header fields), or None if the file is missing,
+        truncated or not a cache file of this version
+    """
+    try:
+        with open(cache_path, "rb") as cache:
+            buffer = mmap.mmap(cache.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    if len(buffer) < HEADER.size:
+        return None
+    fields = HEADER.unpack_from(buffer)
+    magic, node_count, edge_count, names_size = fields[:4]
+    if magic != MAGIC or min(node_count, edge_count, names_size) < 0:
+        return None
+    expected = (8 * (node_count + 1) + 4 * edge_count + (-4 * edge_count % 8)
+                + 8 * edge_count + names_size)
+    if len(buffer) < HEADER.size + expected:
+        return None     # truncated or partly written
+
+    view = memoryview(buffer)
+    start = HEADER.size
+    offsets = view[start:start + 8 * (node_count + 1)].cast("q")
+    start += 8 * (node_count + 1)
+    targets = view[start:start + 4 * edge_count].cast("i")
+    start += 4 * edge_count + (-4 * edge_count % 8)
+    weights = view[start:start + 8 * edge_count].cast("d")
+    start += 8 * edge_count
+    names = bytes(view[start:start + names_size]).decode("utf-8")
+    names = names.split("\n") if node_count else [ ]
+
+    graph = RoadGraph(names, offsets, targets, weights)
+    graph.buffer = buffer    # keeps the mapping open as long as the graph lives
+    return graph, fields
+
+
+def load_graph(map_path, use_cache=True, errors=None):
+    """Load the map file at map_path, through its binary cache if possible.
+    Args:
+        map_path: name of a map file in the format read by read_map()
+        use_cache: if False, always parse map_path and leave the cache alone
+        errors: list to which (line number, reason) pairs are appended for
+            malformed lines skipped while parsing; nothing is appended when
+            the graph comes from an up to date cache
+    Returns:
+        RoadGraph for the map; when it was parsed from text, the cache is
+        (re)written as a side effect unless the directory is not writable
+    """
+    if not use_cache:
+        return read_map(map_path, errors)
+
+    cache_path = map_path + CACHE_SUFFIX
+    source_stat = os.stat(map_path)
+    cached = read_cache(cache_path)
+    digest = None
+    if cached is not None:
+        graph, fields = cached
+        size, mtime_ns, cached_digest = fields[4:]
+        if size == source_stat.st_size and mtime_ns == source_stat.st_mtime_ns:
+            return graph
+        digest = source_digest(map_path)
+        if size == source_stat.st_size and digest == cached_digest:
+            # touched but unchanged: record the new mtime so later loads
+            # take the fast path again
+            try:
+                with open(cache_path, "r+b") as cache:
+                    header = HEADER.pack(MAGIC, *fields[1:5],
+                                         source_stat.st_mtime_ns, digest)
+                    cache.write(header)
+            except OSError:
+                pass
+            return graph
+
+    graph = read_map(map_path, errors)
+    if digest is None:
+        digest = source_digest(map_path)
+    try:
+        write_cache(graph, cache_path, source_stat, digest)
+    except OSError:
+        pass    # read-only location, just work from the parsed graph
+    return graph
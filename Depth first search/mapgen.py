@@ -0,0 +1,175 @@
+"""
+Synthetic road map generator.
+Authors: Christopher Jens Johnson
+
+Writes large maps in the format read by dfs.py, for testing and
+benchmarking beyond the handful of roads in cities.txt:
+
+    grid        side x side places, each joined to its right and lower
+                neighbor; costs between 1 and 2 per unit of distance
+    geometric   places scattered at random in a square, joined when closer
+                than a radius chosen for about DEGREE roads per place; costs
+                are the straight-line distance times 1 to 1.3
+    scalefree   Barabasi-Albert preferential attachment: each new place gets
+                DEGREE/2 roads to places picked in proportion to their number
+                of roads, giving a few very well connected hubs
+    random      roads between uniformly random pairs of places
+
+For grid and geometric maps the place coordinates can also be written (as
+"place,x,y" lines, usable with dfs.py --algorithm astar --coords), and the
+straight-line distance never overestimates the road distance.
+
+Usage:
+
+python3 mapgen.py kind places map_file [--coords coord_file] [--seed N]
+"""
+
+import argparse
+import math
+import random
+
+DEGREE = 6
+COST_DECIMALS = 2
+COORD_DECIMALS = 4
+
+
+def round_up(cost):
+    """cost rounded up to COST_DECIMALS decimals, so that a written cost is
+    never below the straight-line distance it was derived from."""
+    scale = 10 ** COST_DECIMALS
+    rounded = math.ceil(cost * scale) / scale
+    return rounded if rounded >= cost else rounded + 1.0 / scale
+
+
+def grid_map(places, rng):
+    """Grid map with about places places.
+    Returns:
+        tuple (roads, coordinates): roads is a list of (from, to, cost),
+        coordinates a dict mapping place names to (x, y)
+    """
+    side = max(1, int(math.isqrt(places)))
+    coordinates = { }
+    roads = [ ]
+    for row in range(side):
+        for col in range(side):
+            place = "r{}c{}".format(row, col)
+            coordinates[place] = (float(col), float(row))
+            if col + 1 < side:
+                roads.append((place, "r{}c{}".format(row, col + 1), rng.uniform(1.0, 2.0)))
+            if row + 1 < side:
+                roads.append((place, "r{}c{}".format(row + 1, col), rng.uniform(1.0, 2.0)))
+    return roads, coordinates
+
+
+def geometric_map(places, rng):
+    """Random geometric map with places places; returns (roads, coordinates)."""
+    size = 1000.0
+    radius = size * math.sqrt(DEGREE / (math.pi * max(places, 1)))
+    # coordinates are rounded as they will be written, so that road costs
+    # are computed from the same positions the A* heuristic sees
+    coordinates = { "p{}".format(place): (round(rng.uniform(0.0, size), COORD_DECIMALS),
+                                          round(rng.uniform(0.0, size), COORD_DECIMALS))
+                    for place in range(places) }
+    cells = { }
+    for place, (x, y) in coordinates.items():
+        cells.setdefault((int(x // radius), int(y // radius)), [ ]).append(place)
+    roads = [ ]
+    for (cx, cy), members in cells.items():
+        nearby = [ other for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+                   for other in cells.get((cx + dx, cy + dy), ()) ]
+        for place in members:
+            x, y = coordinates[place]
+            for other in nearby:
+                if other <= place:
+                    continue    # each pair once
+                ox, oy = coordinates[other]
+                dist = math.hypot(x - ox, y - oy)
+                if dist <= radius:
+                    roads.append((place, other, dist * rng.uniform(1.0, 1.3)))
+    return roads, coordinates
+
+
+def scalefree_map(places, rng):
+    """Barabasi-Albert map with places places; returns (roads, {})."""
+    links = max(1, DEGREE // 2)
+    ends = [ ]      # every place appears once per road it has
+    roads = [ ]
+    for place in range(places):
+        if place <= links:
+            chosen = set(range(place))
+        else:
+            chosen = set()
+            while len(chosen) < links:
+                chosen.add(rng.choice(ends))
+        for other in chosen:
+            roads.append(("n{}".format(place), "n{}".format(other),
+                          float(rng.randint(1, 100))))
+            ends.extend((place, other))
+    return roads, { }
+
+
+def random_map(places, rng):
+    """Map of places*DEGREE/2 roads between random places; returns (roads, {})."""
+    roads = [ ("Place {}".format(rng.randrange(places)),
+               "Place {}".format(rng.randrange(places)),
+               float(rng.randint(1, 500)))
+              for road in range(places * DEGREE // 2) ]
+    return roads, { }
+
+
+GENERATORS = {
+    "grid": grid_map,
+    "geometric": geometric_map,
+    "scalefree": scalefree_map,
+    "random": random_map,
+}
+
+
+def write_map(path, kind, places, seed=210, coord_path=None):
+    """Generate a map and write it (and optionally its coordinates).
+    Args:
+        path: name of the map file to write
+        kind: one of the keys of GENERATORS
+        places: approximate number of places
+        seed: random seed, so maps can be regenerated exactly
+        coord_path: if given, name of a file to write "place,x,y" lines to
+    Returns:
+        tuple (number of places with coordinates, number of roads)
+    """
+    rng = random.Random(seed)
+    roads, coordinates = GENERATORS[kind](places, rng)
+    with open(path, "w") as map_file:
+        map_file.write("# {} map, {} places, seed {}\n".format(kind, places, seed))
+        for place_from, place_to, cost in roads:
+            map_file.write("{},{},{:.{}f}\n".format(place_from, place_to,
+                                                   round_up(cost), COST_DECIMALS))
+    if coord_path is not None:
+        with open(coord_path, "w") as coord_file:
+            for place, (x, y) in coordinates.items():
+                coord_file.write("{},{:.{}f},{:.{}f}\n".format(
+                    place, x, COORD_DECIMALS, y, COORD_DECIMALS))
+    return len(coordinates), len(roads)
+
+
+def main():
+    """
+    Main program gets the kind and size of map and writes it.
+    """
+    parser = argparse.ArgumentParser(description="Generate a synthetic road map")
+    parser.add_argument('kind', choices=sorted(GENERATORS),
+                help = "Shape of the road network")
+    parser.add_argument('places', type=int,
+                help = "Approximate number of places")
+    parser.add_argument('map_file',
+                help = "Name of the map file to write")
+    parser.add_argument('--coords', metavar='COORD_FILE',
+                help = "Also write place coordinates (grid and geometric maps)")
+    parser.add_argument('--seed', type=int, default=210,
+                help = "Random seed")
+    args = parser.parse_args()
+    located, roads = write_map(args.map_file, args.kind, args.places,
+                               args.seed, args.coords)
+    print("Wrote {} roads to {}".format(roads, args.map_file))
+
+if __name__ == "__main__":
+    main()
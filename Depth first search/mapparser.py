@@ -0,0 +1,189 @@
+"""
+High-throughput map file parser.
+Authors: Christopher Jens Johnson
+
+read_graph() in roadgraph.py handles one line at a time with split(",") and
+float(), and gives up on the whole file at the first malformed line. The
+parser here reads the file in large binary chunks and handles a whole chunk
+with a handful of bulk bytes operations when it can:
+
+    b",".join(lines).split(b",")
+                                  every field of every line, so that fields
+                                  [2::3] are the costs and the rest the from
+                                  and to places, in line order
+
+That fast path is taken when every line of the chunk has exactly three
+non-empty unquoted fields and no comments or blank lines. Otherwise only the
+other lines are parsed one at a time, and the runs of plain lines between
+them still go through the bulk path; csv handles place names in double
+quotes (which may contain commas), e.g.
+
+    "Portland, OR","Portland, ME",3100
+
+Malformed lines (wrong number of fields, empty place names, costs that are
+not finite non-negative numbers) are skipped and reported as (line number,
+reason) pairs rather than aborting the load.
+"""
+
+import csv
+import itertools
+import math
+import re
+from array import array
+
+from roadgraph import RoadGraph
+
+CHUNK_SIZE = 1 << 22    # bytes read from the map file at a time
+
+# a line the bulk path can split: three non-empty unquoted fields, no comment
+# and no surrounding whitespace
+PLAIN_LINE = re.compile(rb'[^\s",#][^",#\t\r\n]*,[^",#\t\r\n]+,[^",#\t\r\n]*[^\s",#]')
+
+
+def _parse_line(line, number, index, fields_out, errors):
+    """Parse one line of a chunk on the slow path.
+    Args:
+        line: bytes, without the trailing newline
+        number: line number of line in the file (1-based)
+        index: dict interning place names (bytes) to ids
+        fields_out: tuple (sources, targets, costs) of arrays to append to
+        errors: list to append (number, reason) to if line is malformed
+    """
+    line = line.strip()
+    if line == b"" or line.startswith(b"#"):
+        return
+    if b'"' in line:
+        try:
+            fields = next(csv.reader([line.decode("utf-8")]))
+        except (csv.Error, UnicodeDecodeError) as err:
+            errors.append((number, "cannot split line: {}".format(err)))
+            return
+        fields = [field.encode("utf-8") for field in fields]
+    else:
+        fields = line.split(b",")
+    if len(fields) != 3:
+        errors.append((number, "expected 3 fields, found {}".format(len(fields))))
+        return
+    if fields[0] == b"" or fields[1] == b"":
+        errors.append((number, "empty place name"))
+        return
+    try:
+        cost = float(fields[2])
+    except ValueError:
+        errors.append((number, "cost {!r} is not a number".format(
+            fields[2].decode("utf-8", "replace"))))
+        return
+    if not (0.0 <= cost < math.inf):
+        errors.append((number, "cost {} is not a finite non-negative number".format(cost)))
+        return
+    sources, targets, costs = fields_out
+    sources.append(index.setdefault(fields[0], len(index)))
+    targets.append(index.setdefault(fields[1], len(index)))
+    costs.append(cost)
+
+
+def _is_plain(text, lines):
+    """True if every line is "from,to,cost" without quotes, comments, blank
+    lines, empty fields or surrounding whitespace, so the chunk can be split
+    in bulk."""
+    if not lines or text.strip() != text:
+        return False
+    if text.startswith(b",") or text.endswith(b","):
+        return False
+    for marker in (b'"', b"#", b"\t", b"\r", b"\n\n", b"\n ", b" \n",
+                   b",,", b"\n,", b",\n"):
+        if marker in text:
+            return False
+    comma_counts = list(map(bytes.count, lines, itertools.repeat(b",")))
+    return comma_counts.count(2) == len(lines)
+
+
+def _parse_plain(lines, index, fields_out):
+    """Parse lines that are all "from,to,cost" (see PLAIN_LINE) in bulk.
+    Returns:
+        True, or False without adding anything if some cost is not a finite
+        non-negative number
+    """
+    fields = b",".join(lines).split(b",")
+    try:
+        costs = array('d', map(float, fields[2::3]))
+    except ValueError:
+        return False
+    # a NaN or infinite cost makes the sum NaN or infinite
+    if not (min(costs) >= 0.0 and sum(costs) < math.inf):
+        return False
+    del fields[2::3]
+    # interned in line order, so ids do not depend on which path a line takes
+    intern = index.setdefault
+    ends = array('i', [intern(name, len(index)) for name in fields])
+    sources, targets, all_costs = fields_out
+    sources.extend(ends[0::2])
+    targets.extend(ends[1::2])
+    all_costs.extend(costs)
+    return True
+
+
+def _parse_chunk(text, first_number, index, fields_out, errors):
+    """Parse a chunk of complete lines, in bulk where they are well formed.
+    Returns:
+        number of lines in the chunk
+    """
+    lines = text.split(b"\n")
+    if _is_plain(text, lines) and _parse_plain(lines, index, fields_out):
+        return len(lines)
+    # runs of plain lines between the others (comments, quoted names,
+    # malformed lines) are still parsed in bulk, in file order
+    others = [offset for offset, match in enumerate(map(PLAIN_LINE.fullmatch, lines))
+              if match is None]
+    start = 0
+    for end in others + [len(lines)]:
+        if end > start and not _parse_plain(lines[start:end], index, fields_out):
+            for offset in range(start, end):
+                _parse_line(lines[offset], first_number + offset, index, fields_out, errors)
+        if end < len(lines):
+            _parse_line(lines[end], first_number + end, index, fields_out, errors)
+        start = end + 1
+    return len(lines)
+
+
+def parse_map(map_file, errors=None, chunk_size=CHUNK_SIZE):
+    """Parse a map file into a RoadGraph, reading it in large chunks.
+    Args:
+        map_file: file opened in binary mode, in the format read by
+            roadgraph.read_graph(), optionally with quoted place names
+        errors: list to which (line number, reason) pairs are appended for
+            malformed lines, which are skipped; if None, they are discarded
+        chunk_size: number of bytes read at a time
+    Returns:
+        RoadGraph holding both directions of every well-formed road
+    """
+    if errors is None:
+        errors = [ ]
+    index = { }
+    fields_out = (array('i'), array('i'), array('d'))
+    leftover = b""
+    number = 1
+    while True:
+        chunk = map_file.read(chunk_size)
+        if not chunk:
+            break
+        text = (leftover + chunk).replace(b"\r\n", b"\n")
+        end = text.rfind(b"\n")
+        if end < 0:
+            leftover = text
+            continue
+        leftover = text[end + 1:]
+        number += _parse_chunk(text[:end], number, index, fields_out, errors)
+    if leftover:
+        _parse_line(leftover, number, index, fields_out, errors)
+
+    names = [name.decode("utf-8", "replace") for name in index]
+    sources, targets, costs = fields_out
+    return RoadGraph.from_edges(names, sources + targets, targets + sources,
+                                costs + costs)
+
+
+def read_map(map_path, errors=None, chunk_size=CHUNK_SIZE):
+    """Parse the map file named map_path with parse_map()."""
+    with open(map_path, "rb") as map_file:
+        return parse_map(map_file, errors, chunk_size)
@@ -0,0 +1,136 @@
+"""
+Radius ("isochrone") and k-nearest queries on a road map.
+Authors: Christopher Jens Johnson
+
+Questions like "all places within 300 miles of Denver" or "the 10 depots
+closest to any of our warehouses" only need the part of the map near the
+starting places. The searches here run Dijkstra's algorithm from all the
+starting places at once (a multi-source search: every start is put on the
+frontier at distance 0) and stop as soon as the frontier passes the radius,
+or as soon as k places of interest have been settled.
+
+Usage:
+
+python3 nearby.py map_file place [place ...] --within 500
+python3 nearby.py map_file place [place ...] --nearest 10 [--among places_file]
+"""
+
+import argparse
+import heapq
+
+from graphcache import load_graph
+
+INFINITY = float('inf')
+
+
+def expand(graph, sources, radius=INFINITY):
+    """Multi-source Dijkstra search, settling places in order of distance.
+    Args:
+        graph: RoadGraph to search
+        sources: iterable of place ids to start from
+        radius: places farther than this from every source are not settled;
+            the search stops at the first one
+    Returns:
+        generator of (place id, distance, id of the nearest source) tuples
+        in order of increasing distance; it explores the map only as far as
+        it is consumed
+    """
+    offsets = graph.offsets
+    targets = graph.targets
+    weights = graph.weights
+    distances = { }
+    frontier = [ ]
+    for source in sources:
+        distances[source] = 0.0
+        frontier.append((0.0, source, source))
+    heapq.heapify(frontier)
+    settled = set()
+    while frontier:
+        dist_so_far, node, origin = heapq.heappop(frontier)
+        if dist_so_far > radius:
+            return
+        if node in settled:
+            continue
+        settled.add(node)
+        yield node, dist_so_far, origin
+        for i in range(offsets[node], offsets[node + 1]):
+            to_node = targets[i]
+            dist = dist_so_far + weights[i]
+            if dist <= radius and dist < distances.get(to_node, INFINITY):
+                distances[to_node] = dist
+                heapq.heappush(frontier, (dist, to_node, origin))
+
+
+def within_radius(graph, sources, radius):
+    """All places within radius of any source.
+    Returns:
+        list of (place id, distance, nearest source id), nearest first
+    """
+    return list(expand(graph, sources, radius))
+
+
+def k_nearest(graph, sources, k, among=None, radius=INFINITY):
+    """The k places closest to any source.
+    Args:
+        graph, sources, radius: as for expand()
+        k: number of places wanted
+        among: optional set of place ids; if given, only these places
+            (e.g. depots) are counted and returned
+    Returns:
+        list of up to k (place id, distance, nearest source id), nearest first
+    """
+    found = [ ]
+    if k <= 0:
+        return found
+    for settled in expand(graph, sources, radius):
+        if among is None or settled[0] in among:
+            found.append(settled)
+            if len(found) == k:
+                break
+    return found
+
+
+def main():
+    """
+    Main program gets the starting places and the radius or count, and
+    prints the places found with their distances.
+    """
+    parser = argparse.ArgumentParser(
+        description="Find places near one or more starting places")
+    parser.add_argument('map_file',
+                help = "Name of file containing road connections and distances")
+    parser.add_argument('places', nargs='+',
+                help = "Starting places (quoted if they contain blanks)")
+    limit = parser.add_mutually_exclusive_group(required=True)
+    limit.add_argument('--within', type=float, metavar='DISTANCE',
+                help = "List every place within DISTANCE of a starting place")
+    limit.add_argument('--nearest', type=int, metavar='K',
+                help = "List the K places nearest to a starting place")
+    parser.add_argument('--among', type=argparse.FileType('r'), metavar='PLACES_FILE',
+                help = "With --nearest, only consider the places listed "
+                       "(one per line) in PLACES_FILE")
+    args = parser.parse_args()
+    try:
+        graph = load_graph(args.map_file)
+    except OSError as err:
+        parser.error("argument map_file: can't open '{}': {}".format(args.map_file, err))
+    for place in args.places:
+        if place not in graph:
+            print("Place ", place, " is not on the map")
+            exit(1)
+    sources = [graph.id_of(place) for place in args.places]
+
+    if args.within is not None:
+        found = within_radius(graph, sources, args.within)
+    else:
+        among = None
+        if args.among is not None:
+            among = { graph.id_of(line.strip()) for line in args.among
+                      if line.strip() in graph }
+        found = k_nearest(graph, sources, args.nearest, among)
+    for node, distance, origin in found:
+        print("{} is {} from {}".format(graph.name_of(node), distance,
+                                        graph.name_of(origin)))
+
+if __name__ == "__main__":
+    main()
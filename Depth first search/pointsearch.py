@@ -0,0 +1,194 @@
+"""
+Point-to-point shortest path searches for dfs.py.
+Authors: Christopher Jens Johnson
+
+dijkstra() in dfs.py computes distances to every place reachable from the
+start. When only one destination matters, most of that work is wasted. The
+searches here stop as soon as the shortest route to the destination is known:
+
+    bidirectional_dijkstra()   grows one search from each end and stops when
+                               the two frontiers can no longer improve on the
+                               best meeting point found so far
+    astar()                    goal-directed search guided by a heuristic
+                               lower bound on the remaining distance, such as
+                               the straight-line distance between coordinates
+
+Each returns (distance, route, explored), where explored counts the places
+settled by the search, to compare how much of the map each one touched.
+All searches take a RoadGraph (see roadgraph.py) and place ids. Roads in a
+RoadGraph are bi-directional, so the backward half of the bidirectional
+search follows the same adjacency arrays as the forward half.
+"""
+
+import heapq
+import math
+
+INFINITY = float('inf')
+EARTH_RADIUS_MILES = 3958.8
+
+
+def _walk_back(previous, node):
+    """List of ids from the start of a search to node, following previous."""
+    route = [node]
+    while previous.get(route[-1], -1) >= 0:
+        route.append(previous[route[-1]])
+    route.reverse()
+    return route
+
+
+def bidirectional_dijkstra(graph, source, target):
+    """Shortest route from source to target by searching from both ends.
+    Args:
+        graph: RoadGraph to search
+        source, target: place ids
+    Returns:
+        tuple (distance, route, explored): distance is INFINITY and route is
+        None if target cannot be reached from source; route is a list of
+        place ids from source to target inclusive
+    """
+    if source == target:
+        return 0.0, [source], 1
+    offsets = graph.offsets
+    targets = graph.targets
+    weights = graph.weights
+
+    distances = ({ source: 0.0 }, { target: 0.0 })
+    previous = ({ source: -1 }, { target: -1 })
+    settled = (set(), set())
+    frontiers = ([ (0.0, source) ], [ (0.0, target) ])
+    best = INFINITY
+    meeting = -1
+
+    while frontiers[0] and frontiers[1]:
+        if frontiers[0][0][0] + frontiers[1][0][0] >= best:
+            break
+        side = 0 if frontiers[0][0][0] <= frontiers[1][0][0] else 1
+        dist_so_far, node = heapq.heappop(frontiers[side])
+        if node in settled[side]:
+            continue
+        settled[side].add(node)
+        near = distances[side]
+        far = distances[1 - side]
+        for i in range(offsets[node], offsets[node + 1]):
+            to_node = targets[i]
+            dist = dist_so_far + weights[i]
+            if dist < near.get(to_node, INFINITY):
+                near[to_node] = dist
+                previous[side][to_node] = node
+                heapq.heappush(frontiers[side], (dist, to_node))
+            if to_node in far and dist + far[to_node] < best:
+                best = dist + far[to_node]
+                meeting = to_node
+
+    explored = len(settled[0] | settled[1])
+    if meeting < 0:
+        return INFINITY, None, explored
+    forward = _walk_back(previous[0], meeting)
+    backward = _walk_back(previous[1], meeting)
+    backward.reverse()
+    return best, forward + backward[1:], explored
+
+
+def astar(graph, source, target, heuristic):
+    """A* search from source to target.
+    Args:
+        graph: RoadGraph to search
+        source, target: place ids
+        heuristic: function of a place id returning a lower bound on its
+            distance to target (it must never overestimate, or the route
+            found may not be the shortest); lambda node: 0.0 turns the
+            search into Dijkstra's algorithm with early stopping
+    Returns:
+        tuple (distance, route, explored) as for bidirectional_dijkstra()
+    """
+    offsets = graph.offsets
+    targets = graph.targets
+    weights = graph.weights
+
+    distances = { source: 0.0 }
+    previous = { source: -1 }
+    frontier = [ (heuristic(source), 0.0, source) ]
+    explored = 0
+    while frontier:
+        estimate, dist_so_far, node = heapq.heappop(frontier)
+        if dist_so_far > distances[node]:
+            continue    # stale heap entry
+        explored += 1
+        if node == target:
+            return dist_so_far, _walk_back(previous, target), explored
+        for i in range(offsets[node], offsets[node + 1]):
+            to_node = targets[i]
+            dist = dist_so_far + weights[i]
+            if dist < distances.get(to_node, INFINITY):
+                distances[to_node] = dist
+                previous[to_node] = node
+                heapq.heappush(frontier, (dist + heuristic(to_node), dist, to_node))
+    return INFINITY, None, explored
+
+
+def read_coordinates(coord_file, graph):
+    """Read place coordinates for use by the A* heuristics.
+    Args:
+        coord_file: readable text file of "place,x,y" lines (# comments and
+            blank lines are skipped); places not on the map are ignored
+        graph: RoadGraph whose place ids the coordinates are stored by
+    Returns:
+        dict mapping place ids to (x, y) tuples of floats
+    """
+    coordinates = { }
+    for line in coord_file:
+        line = line.strip()
+        if line.startswith("#") or line == "":
+            continue
+        fields = line.split(",")
+        if fields[0] in graph:
+            coordinates[graph.id_of(fields[0])] = (float(fields[1]), float(fields[2]))
+    return coordinates
+
+
+def euclidean_heuristic(coordinates, target, scale=1.0):
+    """Straight-line distance heuristic for astar().
+    Args:
+        coordinates: dict mapping place ids to planar (x, y) coordinates
+        target: id of the destination place
+        scale: road distance per coordinate unit; the heuristic is admissible
+            when no road is shorter than scale times the straight line
+            between its ends
+    Returns:
+        heuristic function of a place id; places without coordinates get 0.0
+    """
+    if target not in coordinates:
+        return lambda node: 0.0
+    tx, ty = coordinates[target]
+
+    def heuristic(node):
+        if node not in coordinates:
+            return 0.0
+        x, y = coordinates[node]
+        return scale * math.hypot(x - tx, y - ty)
+    return heuristic
+
+
+def great_circle_heuristic(coordinates, target, scale=1.0):
+    """Great-circle distance heuristic for astar().
+    Args:
+        coordinates: dict mapping place ids to (latitude, longitude) in degrees
+        target: id of the destination place
+        scale: road distance per mile of great-circle distance (1.0 if the
+            map's distances are in miles)
+    Returns:
+        heuristic function of a place id; places without coordinates get 0.0
+    """
+    if target not in coordinates:
+        return lambda node: 0.0
+    tlat, tlon = (math.radians(angle) for angle in coordinates[target])
+    cos_tlat = math.cos(tlat)
+
+    def heuristic(node):
+        if node not in coordinates:
+            return 0.0
+        lat, lon = (math.radians(angle) for angle in coordinates[node])
+        a = (math.sin((lat - tlat) / 2) ** 2
+             + math.cos(lat) * cos_tlat * math.sin((lon - tlon) / 2) ** 2)
+        return scale * 2 * EARTH_RADIUS_MILES * math.asin(min(1.0, math.sqrt(a)))
+    return heuristic
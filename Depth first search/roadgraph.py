@@ -0,0 +1,167 @@
+"""
+Compact road graph for the shortest path search in dfs.py.
+Authors: Christopher Jens Johnson
+
+read_distances() in dfs.py keeps a dict of lists of (place, cost) tuples, so
+every road costs two tuples plus references to the place name strings. On
+large maps that overhead dominates memory. A RoadGraph instead interns each
+place name to an integer id and stores the adjacency lists in compressed
+sparse row (CSR) form, as three flat arrays:
+
+    offsets[node] .. offsets[node+1]   slice of the other two arrays
+                                       holding the roads leaving node
+    targets[i]                         id of the place road i leads to
+    weights[i]                         distance (or time) of road i
+
+Like read_distances(), roads are assumed to be bi-directional, so every line
+of the map file becomes two entries in the arrays.
+"""
+
+from array import array
+
+try:
+    import numpy
+except ImportError:     # from_edges() falls back to a pure Python sort
+    numpy = None
+
+
+class RoadGraph:
+
+    """Road network with integer place ids and CSR adjacency arrays.
+    Public data attributes:
+        names: list of place names, names[node] is the name of place id node
+        index: dict mapping place names to their ids
+        offsets: array of node_count+1 ints, see module docstring
+        targets: array of edge_count ints, see module docstring
+        weights: array of edge_count floats, see module docstring
+    """
+
+    def __init__(self, names, offsets, targets, weights):
+        self.names = names
+        self.index = { name: node for node, name in enumerate(names) }
+        self.offsets = offsets
+        self.targets = targets
+        self.weights = weights
+
+    @property
+    def node_count(self):
+        return len(self.names)
+
+    @property
+    def edge_count(self):
+        return len(self.targets)
+
+    def __contains__(self, place):
+        return place in self.index
+
+    def id_of(self, place):
+        """Id of the named place (KeyError if it is not on the map)."""
+        return self.index[place]
+
+    def name_of(self, node):
+        """Name of the place with id node."""
+        return self.names[node]
+
+    def neighbors(self, node):
+        """Iterate over the roads leaving node as (target id, cost) pairs."""
+        targets = self.targets
+        weights = self.weights
+        for i in range(self.offsets[node], self.offsets[node + 1]):
+            yield targets[i], weights[i]
+
+    @classmethod
+    def from_edges(cls, names, sources, targets, weights):
+        """Build a RoadGraph from parallel arrays of directed roads.
+        Args:
+            names: list of place names, indexed by place id
+            sources, targets: sequences of place ids, road i runs from
+                sources[i] to targets[i]
+            weights: sequence of floats, weights[i] is the cost of road i
+        Returns:
+            RoadGraph with the roads bucketed by source, in their original
+            order within each source (a stable sort by source)
+        """
+        if numpy is not None:
+            return cls._from_edges_numpy(names, sources, targets, weights)
+        # counting sort, linear in the number of roads
+        node_count = len(names)
+        offsets = array('q', bytes(8 * (node_count + 1)))
+        for source in sources:
+            offsets[source + 1] += 1
+        for node in range(node_count):
+            offsets[node + 1] += offsets[node]
+
+        fill = array('q', offsets[:-1])
+        csr_targets = array('i', bytes(4 * len(targets)))
+        csr_weights = array('d', bytes(8 * len(weights)))
+        for i in range(len(sources)):
+            slot = fill[sources[i]]
+            fill[sources[i]] = slot + 1
+            csr_targets[slot] = targets[i]
+            csr_weights[slot] = weights[i]
+        return cls(names, offsets, csr_targets, csr_weights)
+
+    @classmethod
+    def _from_edges_numpy(cls, names, sources, targets, weights):
+        """from_edges() with the sort done by NumPy, producing the same
+        arrays several times faster on large maps."""
+        sources = numpy.asarray(sources, dtype=numpy.int32)
+        order = numpy.argsort(sources, kind="stable")
+        counts = numpy.bincount(sources, minlength=len(names))
+        offsets = array('q', bytes(8))
+        offsets.frombytes(numpy.cumsum(counts, dtype=numpy.int64).tobytes())
+        csr_targets = array('i')
+        csr_targets.frombytes(numpy.asarray(targets, dtype=numpy.int32)[order].tobytes())
+        csr_weights = array('d')
+        csr_weights.frombytes(numpy.asarray(weights, dtype=numpy.float64)[order].tobytes())
+        return cls(names, offsets, csr_targets, csr_weights)
+
+    @classmethod
+    def from_roads(cls, roads):
+        """Build a RoadGraph from the dict of lists built by read_distances()."""
+        names = list(roads)
+        index = { name: node for node, name in enumerate(names) }
+        sources = array('i')
+        targets = array('i')
+        weights = array('d')
+        for place_from, hops in roads.items():
+            for place_to, cost in hops:
+                sources.append(index[place_from])
+                targets.append(index[place_to])
+                weights.append(cost)
+        return cls.from_edges(names, sources, targets, weights)
+
+
+def read_graph(map_file):
+    """Read a distance table from a map file into a RoadGraph.
+    Args:
+       map_file: A readable text file in the format read by
+           dfs.read_distances(), i.e. comment lines starting with # and
+           lines of the form from location, to location, distance
+    Returns:
+        RoadGraph holding both directions of every road in the file
+    """
+    names = [ ]
+    index = { }
+    sources = array('i')
+    targets = array('i')
+    weights = array('d')
+    for line in map_file:
+        line = line.strip()
+        if line.startswith("#") or line == "":
+            continue
+        fields = line.split(",")
+        ends = [ ]
+        for place in fields[0], fields[1]:
+            if place not in index:
+                index[place] = len(names)
+                names.append(place)
+            ends.append(index[place])
+        cost = float(fields[2])
+        sources.append(ends[0])
+        targets.append(ends[1])
+        weights.append(cost)
+        sources.append(ends[1])
+        targets.append(ends[0])
+        weights.append(cost)
+    return RoadGraph.from_edges(names, sources, targets, weights)
@@ -0,0 +1,228 @@
+"""
+Long-lived routing server for a map file.
+Authors: Christopher Jens Johnson
+
+Starting dfs.py for every query spends most of its time starting Python and
+loading the map. This server loads the map once and answers HTTP queries on
+localhost (or on a Unix socket) with asyncio:
+
+    GET /distance?from=Denver&to=Dallas   {"from": ..., "to": ..., "distance": 1112.0}
+    GET /route?from=Denver&to=Dallas      the same, plus "route": [places]
+    GET /stats                            cache and latency counters
+
+("distance" is null when there is no route.) Each answer comes from a full
+single-source dijkstra() run from the starting place; the results of the
+most recent runs are kept in an LRU cache, so further queries from the same
+place are answered without searching. Concurrent queries from the same
+place that miss the cache share one search. Searches run in a worker thread
+so the event loop keeps accepting connections meanwhile.
+
+Usage:
+
+python3 routeserver.py map_file [--port 8021 | --socket path] [--cache-size 64]
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import time
+import urllib.parse
+
+from dfs import dijkstra, find_route, INFINITY
+from graphcache import load_graph
+
+
+class RouteCache:
+
+    """LRU cache of single-source search results, with usage counters.
+    Public data attributes (read only):
+        hits, misses: number of lookups answered from / not found in the cache
+    """
+
+    def __init__(self, graph, capacity):
+        self.graph = graph
+        self.capacity = capacity
+        self.results = collections.OrderedDict()   # source -> (distances, previous)
+        self.pending = { }                         # source -> future of a running search
+        self.hits = 0
+        self.misses = 0
+
+    async def search(self, source):
+        """(distances, previous) from dijkstra() for source, cached."""
+        if source in self.results:
+            self.hits += 1
+            self.results.move_to_end(source)
+            return self.results[source]
+        self.misses += 1
+        if source not in self.pending:
+            loop = asyncio.get_running_loop()
+            self.pending[source] = loop.run_in_executor(
+                None, dijkstra, source, self.graph)
+        try:
+            result = await self.pending[source]
+        finally:
+            self.pending.pop(source, None)
+        self.results[source] = result
+        self.results.move_to_end(source)
+        while len(self.results) > self.capacity:
+            self.results.popitem(last=False)
+        return result
+
+
+class RouteServer:
+
+    """HTTP request handling for one loaded map."""
+
+    def __init__(self, graph, cache_size):
+        self.graph = graph
+        self.cache = RouteCache(graph, cache_size)
+        self.requests = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def stats(self):
+        """Counters reported by GET /stats."""
+        return {
+            "places": self.graph.node_count,
+            "requests": self.requests,
+            "cache_hits": self.cache.hits,
+            "cache_misses": self.cache.misses,
+            "cached_sources": len(self.cache.results),
+            "mean_latency_ms": 1000.0 * self.total_latency / max(self.requests, 1),
+            "max_latency_ms": 1000.0 * self.max_latency,
+        }
+
+    async def answer(self, path, query):
+        """Status code and JSON-able body for a request.
+        Args:
+            path: URL path, e.g. "/route"
+            query: dict of query parameters (first value of each)
+        """
+        if path == "/stats":
+            return 200, self.stats()
+        if path not in ("/distance", "/route"):
+            return 404, {"error": "unknown path " + path}
+        places = [query.get("from"), query.get("to")]
+        if None in places:
+            return 400, {"error": "need from and to parameters"}
+        for place in places:
+            if place not in self.graph:
+                return 404, {"error": "{} is not on the map".format(place)}
+        source, target = (self.graph.id_of(place) for place in places)
+        distances, previous = await self.cache.search(source)
+        body = {"from": places[0], "to": places[1],
+                "distance": distances[target] if distances[target] < INFINITY else None}
+        if path == "/route":
+            route = find_route(previous, source, target)
+            body["route"] = None if route is None else [
+                self.graph.name_of(node) for node in route]
+        return 200, body
+
+    async def respond(self, request_line):
+        """Status code and JSON-able body for a request line."""
+        parts = request_line.decode("latin1").split()
+        if len(parts) != 3 or parts[0] != "GET":
+            return 400, {"error": "only GET requests are supported"}
+        try:
+            url = urllib.parse.urlsplit(parts[1])
+        except ValueError as err:
+            return 400, {"error": "bad request target: {}".format(err)}
+        query = { name: values[0] for name, values
+                  in urllib.parse.parse_qs(url.query).items() }
+        return await self.answer(url.path, query)
+
+    async def handle(self, reader, writer):
+        """Serve HTTP/1.1 requests on one connection (keep-alive supported).
+        Every request gets a response: a query that fails answers 500 with
+        the error in the body rather than leaving the client waiting."""
+        try:
+            while True:
+                try:
+                    request_line = await reader.readline()
+                    if not request_line:
+                        break
+                    headers = { }
+                    while True:
+                        line = await reader.readline()
+                        if line in (b"\r\n", b"\n", b""):
+                            break
+                        name, _, value = line.decode("latin1").partition(":")
+                        headers[name.strip().lower()] = value.strip()
+                except ValueError:
+                    # a line longer than the stream's limit
+                    _write_response(writer, 400, {"error": "request line or header too long"},
+                                    False)
+                    await writer.drain()
+                    break
+
+                start = time.perf_counter()
+                try:
+                    status, body = await self.respond(request_line)
+                except ConnectionError:
+                    raise
+                except Exception as err:
+                    status, body = 500, {"error": "{}: {}".format(type(err).__name__, err)}
+                elapsed = time.perf_counter() - start
+                self.requests += 1
+                self.total_latency += elapsed
+                self.max_latency = max(self.max_latency, elapsed)
+
+                keep_alive = headers.get("connection", "").lower() != "close"
+                _write_response(writer, status, body, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+def _write_response(writer, status, body, keep_alive):
+    """Queue an HTTP/1.1 response with a JSON body on writer."""
+    payload = json.dumps(body).encode("utf-8")
+    writer.write("HTTP/1.1 {} {}\r\nContent-Type: application/json\r\n"
+                 "Content-Length: {}\r\nConnection: {}\r\n\r\n".format(
+                     status, "OK" if status == 200 else "Error",
+                     len(payload), "keep-alive" if keep_alive else "close"
+                 ).encode("latin1") + payload)
+
+async def serve(server, port=None, socket_path=None):
+    """Run server on localhost:port, or on the Unix socket socket_path."""
+    if socket_path is not None:
+        listener = await asyncio.start_unix_server(server.handle, path=socket_path)
+    else:
+        listener = await asyncio.start_server(server.handle, "127.0.0.1", port)
+    async with listener:
+        await listener.serve_forever()
+
+
+def main():
+    """
+    Main program loads the map and serves queries until interrupted.
+    """
+    parser = argparse.ArgumentParser(description="Serve shortest route queries")
+    parser.add_argument('map_file',
+                help = "Name of file containing road connections and distances")
+    parser.add_argument('--port', type=int, default=8021,
+                help = "Port to listen on (localhost only)")
+    parser.add_argument('--socket', metavar='PATH',
+                help = "Listen on this Unix socket instead of a port")
+    parser.add_argument('--cache-size', type=int, default=64,
+                help = "Number of starting places whose results are cached")
+    args = parser.parse_args()
+    try:
+        graph = load_graph(args.map_file)
+    except OSError as err:
+        parser.error("argument map_file: can't open '{}': {}".format(args.map_file, err))
+    server = RouteServer(graph, args.cache_size)
+    print("Serving {} places on {}".format(server.graph.node_count,
+          args.socket if args.socket else "http://127.0.0.1:{}".format(args.port)))
+    try:
+        asyncio.run(serve(server, args.port, args.socket))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
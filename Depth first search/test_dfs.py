@@ -0,0 +1,45 @@
+"""
+Tests for the dfs.py command line.
+Authors: Christopher Jens Johnson
+
+Run with:  python3 -m pytest test_dfs.py   (or python3 -m unittest)
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def run(*args):
+    """Run dfs.py; returns (exit status, output)."""
+    done = subprocess.run([sys.executable, os.path.join(HERE, "dfs.py")] + list(args),
+                          cwd=HERE, capture_output=True, text=True, timeout=60)
+    return done.returncode, done.stdout + done.stderr
+
+
+class MapFileTest(unittest.TestCase):
+
+    def test_missing_map_file(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            status, output = run("Denver", "Dallas",
+                                 os.path.join(work_dir, "missing.txt"))
+        self.assertEqual(status, 2, output)
+        self.assertIn("can't open", output)
+        self.assertNotIn("Traceback", output)
+
+    def test_query(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            map_file = os.path.join(work_dir, "map.txt")
+            with open(map_file, "w") as fd:
+                fd.write("Denver,Dallas,1112\nDallas,Austin,195\n")
+            status, output = run("--no-cache", "Denver", "Austin", map_file)
+        self.assertEqual(status, 0, output)
+        self.assertIn("1307", output)
+
+
+if __name__ == "__main__":
+    unittest.main()
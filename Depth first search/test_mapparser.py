@@ -0,0 +1,55 @@
+"""
+Tests for mapparser.py.
+Authors: Christopher Jens Johnson
+
+Run with:  python3 -m pytest test_mapparser.py   (or python3 -m unittest)
+"""
+
+import unittest
+from io import BytesIO
+
+from mapparser import parse_map
+
+
+def parse(text):
+    """Parse map text; return (graph, errors)."""
+    errors = [ ]
+    return parse_map(BytesIO(text), errors), errors
+
+
+class EmptyFieldTest(unittest.TestCase):
+    """The same malformed line must be reported whether its chunk is split
+    in bulk or a line at a time."""
+
+    BAD_LINES = [b"a,,3", b",b,3", b"a,b,"]
+
+    def check(self, text, bad_number):
+        graph, errors = parse(text)
+        self.assertEqual([number for number, reason in errors], [bad_number])
+        self.assertNotIn("", graph.names)
+        self.assertIn("c", graph)
+
+    def test_fast_path_candidate(self):
+        for bad in self.BAD_LINES:
+            with self.subTest(line=bad):
+                self.check(bad + b"\nb,c,4\n", 1)
+
+    def test_slow_path(self):
+        for bad in self.BAD_LINES:
+            with self.subTest(line=bad):
+                # the comment line forces the line-at-a-time parse
+                self.check(b"# roads\n" + bad + b"\nb,c,4\n", 2)
+
+    def test_last_line_of_chunk(self):
+        graph, errors = parse(b"b,c,4\na,,3")
+        self.assertEqual([number for number, reason in errors], [2])
+        self.assertNotIn("", graph.names)
+
+    def test_plain_chunk_still_parsed(self):
+        graph, errors = parse(b"a,b,3\nb,c,4\n")
+        self.assertEqual(errors, [ ])
+        self.assertEqual(sorted(graph.names), ["a", "b", "c"])
+
+
+if __name__ == "__main__":
+    unittest.main()
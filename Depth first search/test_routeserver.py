@@ -0,0 +1,93 @@
+"""
+Tests for routeserver.py.
+Authors: Christopher Jens Johnson
+
+Run with:  python3 -m pytest test_routeserver.py   (or python3 -m unittest)
+"""
+
+import asyncio
+import json
+import unittest
+from io import BytesIO
+
+from mapparser import parse_map
+from routeserver import RouteServer
+
+MAP = b"Denver,Dallas,1112\nDallas,Austin,195\n"
+
+
+async def exchange(server, *requests):
+    """Send raw requests over one connection to a server on a free port.
+    Returns:
+        list of (status, body) pairs, one per response
+    """
+    listener = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+    port = listener.sockets[0].getsockname()[1]
+    async with listener:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        responses = [ ]
+        for request in requests:
+            writer.write(request)
+            # a request the server drops fails the test instead of hanging it
+            responses.append(await asyncio.wait_for(read_response(reader), 5))
+        writer.close()
+        return responses
+
+
+async def read_response(reader):
+    """Read one HTTP response; returns (status, decoded JSON body)."""
+    status_line = await reader.readline()
+    headers = { }
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers["content-length"]))
+    return int(status_line.split()[1]), json.loads(body)
+
+
+def run(server, *requests):
+    return asyncio.run(exchange(server, *requests))
+
+
+class MalformedRequestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = RouteServer(parse_map(BytesIO(MAP)), 8)
+
+    def test_malformed_request_line(self):
+        [(status, body)] = run(self.server, b"NONSENSE\r\n\r\n")
+        self.assertEqual(status, 400)
+        self.assertIn("error", body)
+
+    def test_bad_request_target(self):
+        [(status, body)] = run(self.server, b"GET //[oops HTTP/1.1\r\n\r\n")
+        self.assertEqual(status, 400)
+
+    def test_unknown_place(self):
+        [(status, body)] = run(self.server,
+                               b"GET /distance?from=Denver&to=Nowhere HTTP/1.1\r\n\r\n")
+        self.assertEqual(status, 404)
+
+    def test_failing_query_answers_and_keeps_connection(self):
+        async def broken(source):
+            raise RuntimeError("search failed")
+        self.server.cache.search = broken
+        responses = run(self.server,
+                        b"GET /distance?from=Denver&to=Austin HTTP/1.1\r\n\r\n",
+                        b"GET /stats HTTP/1.1\r\n\r\n")
+        self.assertEqual(responses[0][0], 500)
+        self.assertIn("search failed", responses[0][1]["error"])
+        self.assertEqual(responses[1][0], 200)
+
+    def test_good_query(self):
+        [(status, body)] = run(self.server,
+                               b"GET /distance?from=Denver&to=Austin HTTP/1.1\r\n\r\n")
+        self.assertEqual(status, 200)
+        self.assertEqual(body["distance"], 1307.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
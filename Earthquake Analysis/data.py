@@ -1,3 +1,7 @@
+import itertools
+import json
+import math
+import random
 import turtle
 
 def data_mean(my_list):
@@ -209,3 +213,532 @@ def data_range(my_list):
             min_so_far = item
     return max_so_far - min_so_far
 
+def _select(values, rank, lo, hi):
+    """
+    rearranges values[lo:hi+1] in place so that values[rank] is the value of
+        that rank, with no larger value before it and no smaller one after
+        it (introselect: quickselect with median-of-three pivots and
+        three-way partitioning, which falls back to sorting the remaining
+        range when the pivots keep splitting it badly)
+    """
+    depth = 2 * (hi - lo + 1).bit_length()
+    while hi > lo:
+        if depth == 0:
+            values[lo:hi + 1] = sorted(values[lo:hi + 1])
+            return
+        depth -= 1
+        pivot = sorted((values[lo], values[(lo + hi) // 2], values[hi]))[1]
+        lt, i, gt = lo, lo, hi
+        while i <= gt:
+            item = values[i]
+            if item < pivot:
+                values[i] = values[lt]
+                values[lt] = item
+                lt += 1
+                i += 1
+            elif item > pivot:
+                values[i] = values[gt]
+                values[gt] = item
+                gt -= 1
+            else:
+                i += 1
+        if rank < lt:
+            hi = lt - 1
+        elif rank > gt:
+            lo = gt + 1
+        else:
+            return
+
+def _order_statistics(values, ranks, copy):
+    """
+    the values of the given ranks (0 = smallest), found by selection
+    Args:
+        values: list or NumPy array, rearranged in place unless copy is True
+        ranks: sorted list of distinct ints
+        copy: bool, work on a copy and leave 'values' alone
+    Returns:
+        list of floats, one per rank
+    """
+    if hasattr(values, 'partition'):
+        # NumPy array: its partition() is an introselect written in C
+        if copy:
+            values = values.copy()
+        values.partition(ranks)
+        return [float(values[rank]) for rank in ranks]
+    if copy:
+        values = list(values)
+    lo = 0
+    for rank in ranks:
+        _select(values, rank, lo, len(values) - 1)
+        lo = rank + 1
+    return [values[rank] for rank in ranks]
+
+def data_percentiles(my_list, fractions, copy=False):
+    """
+    computes quantiles of the elements of a list by selection, in linear
+        expected time, interpolating between neighbouring elements like
+        data_median() does
+    Args:
+        my_list: list or NumPy array of floats (MUST BE NON-EMPTY); it is
+                 rearranged in place (its values are kept) unless copy is True
+        fractions: list of floats between 0 and 1, e.g. [0.5, 0.9, 0.99]
+        copy: bool, leave my_list in its original order at the cost of
+              copying it
+    Returns:
+        list of floats, the quantile for each fraction
+    """
+    positions = [fraction * (len(my_list) - 1) for fraction in fractions]
+    ranks = set()
+    for position in positions:
+        ranks.add(int(position))
+        if position > int(position):
+            ranks.add(int(position) + 1)
+    ranks = sorted(ranks)
+    found = dict(zip(ranks, _order_statistics(my_list, ranks, copy)))
+    quantiles = []
+    for position in positions:
+        lower = found[int(position)]
+        if position > int(position):
+            lower += (found[int(position) + 1] - lower) * (position - int(position))
+        quantiles.append(lower)
+    return quantiles
+
+def data_quantile(my_list, fraction, copy=False):
+    """
+    computes one quantile of the elements of a list by selection
+    Args:
+        my_list, copy: as for data_percentiles
+        fraction: float between 0 and 1
+    Returns:
+        float, the quantile
+    """
+    return data_percentiles(my_list, [fraction], copy)[0]
+
+def data_select_median(my_list, copy=False):
+    """
+    computes the median value of the elements of a list, like data_median()
+        but by selection instead of sorting a copy
+    Args:
+        my_list, copy: as for data_percentiles
+    Returns:
+        float, median value of elements in my_list
+    """
+    return data_quantile(my_list, 0.5, copy)
+
+class DataAccumulator:
+    """
+    single-pass statistics over a stream of values: count, mean, variance,
+        min, max, frequency counts (hence mode) and quantiles
+    The values themselves are not kept, but the frequency table holds one
+        count per distinct value, so with resolution None its size grows
+        with the number of distinct values seen (up to one per value for
+        continuous data). Give a resolution, or rely on a sketch, to bound
+        the memory of a long-lived accumulator.
+    Accumulators of different parts of the data can be merged, so chunks
+        can be summarized separately (e.g. in parallel) and then combined.
+    Public data attributes:
+        count: int, number of values seen
+        mean: float, mean of the values seen
+        minimum, maximum: floats, smallest and largest values seen
+        counts: dictionary mapping each (rounded) value to its frequency
+        resolution: float or None, see __init__
+        sketch: QuantileSketch or None, see __init__
+    """
+
+    def __init__(self, resolution=None, sketch=None):
+        """
+        Args:
+            resolution: if None, frequencies and quantiles are exact, at the
+                cost of one table entry per distinct value; if a float, values are rounded to a multiple of it before they are
+                counted, which bounds the size of the frequency table for
+                continuous data, and quantiles are then approximate to within
+                resolution / 2 (mean, variance, min and max stay exact)
+            sketch: optional QuantileSketch that is fed every value too, for
+                percentiles in bounded memory
+        """
+        self.resolution = resolution
+        self.sketch = sketch
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0   # sum of squared differences from the mean
+        self.minimum = float('inf')
+        self.maximum = float('-inf')
+        self.counts = {}
+
+    def add(self, item):
+        """
+        adds one value to the statistics
+        Args:
+            item: float
+        """
+        self.update((item,))
+
+    def update(self, items):
+        """
+        adds every value of an iterable to the statistics in one pass
+        Args:
+            items: iterable of floats (list, generator, array column, ...)
+        Returns:
+            the accumulator itself
+        """
+        n = self.count
+        mean = self.mean
+        m2 = self.m2
+        low = self.minimum
+        high = self.maximum
+        counts = self.counts
+        resolution = self.resolution
+        if self.sketch is not None:
+            items = self.sketch.feed(items)
+        for item in items:
+            # Welford's update of the mean and squared differences
+            n += 1
+            delta = item - mean
+            mean += delta / n
+            m2 += delta * (item - mean)
+            if item < low:
+                low = item
+            if item > high:
+                high = item
+            if resolution is not None:
+                item = round(item / resolution) * resolution
+            counts[item] = counts.get(item, 0) + 1
+        self.count = n
+        self.mean = mean
+        self.m2 = m2
+        self.minimum = low
+        self.maximum = high
+        return self
+
+    def merge(self, other):
+        """
+        adds the statistics of another accumulator, as if all its values had
+            been added to this one
+        Args:
+            other: DataAccumulator with the same resolution
+        Returns:
+            the accumulator itself
+        """
+        if other.resolution != self.resolution:
+            raise ValueError("cannot merge accumulators with different resolutions")
+        if other.count == 0:
+            return self
+        n = self.count + other.count
+        delta = other.mean - self.mean
+        # Chan et al.'s pairwise combination of means and squared differences
+        self.m2 += other.m2 + delta * delta * self.count * other.count / n
+        self.mean += delta * other.count / n
+        self.count = n
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+        for item, freq in other.counts.items():
+            self.counts[item] = self.counts.get(item, 0) + freq
+        if self.sketch is not None and other.sketch is not None:
+            self.sketch.merge(other.sketch)
+        return self
+
+    def variance(self):
+        """
+        sample variance, as data_mean_variance() computes it
+        Returns:
+            float, nan if fewer than 2 values have been seen
+        """
+        if self.count < 2:
+            return float('nan')
+        return self.m2 / (self.count - 1)
+
+    def data_range(self):
+        """
+        Returns:
+            float, max - min of the values seen (0 if there are none)
+        """
+        if self.count == 0:
+            return 0
+        return self.maximum - self.minimum
+
+    def mode(self):
+        """
+        Returns:
+            list of the most frequent value[s], as data_mode() returns them
+        """
+        max_count = max(self.counts.values())
+        return [item for item in self.counts if self.counts[item] == max_count]
+
+    def quantile(self, fraction):
+        """
+        computes a quantile from the frequency counts, interpolating between
+            the neighbouring values like data_median() does for the median
+        Args:
+            fraction: float between 0 and 1, e.g. 0.5 for the median
+        Returns:
+            float, the quantile (approximate if a resolution was given)
+        """
+        if self.count == 0:
+            raise ValueError("no values to compute a quantile of")
+        position = fraction * (self.count - 1)
+        lower_rank = int(position)
+        upper_rank = min(lower_rank + 1, self.count - 1)
+        lower = upper = None
+        seen = 0
+        for item in sorted(self.counts):
+            seen += self.counts[item]
+            if lower is None and seen > lower_rank:
+                lower = item
+            if seen > upper_rank:
+                upper = item
+                break
+        return lower + (upper - lower) * (position - lower_rank)
+
+    def median(self):
+        """
+        Returns:
+            float, the median (approximate if a resolution was given)
+        """
+        return self.quantile(0.5)
+
+    def freq_table(self):
+        """
+        prints the frequency table, in the format of data_freq_table()
+        Outputs:
+            frequency table printed on the standard output
+        """
+        print("ITEM    FREQUENCY")
+        for item in sorted(self.counts):
+            print('{:5}  {:5}'.format(item, self.counts[item]))
+
+    def to_json(self):
+        """
+        Returns:
+            string, JSON text from which from_json() rebuilds the
+                accumulator (and its sketch, if it has one)
+        """
+        return json.dumps({"resolution": self.resolution, "count": self.count,
+                           "mean": self.mean, "m2": self.m2,
+                           "minimum": self.minimum if self.count else None,
+                           "maximum": self.maximum if self.count else None,
+                           "counts": list(self.counts.items()),
+                           "sketch": None if self.sketch is None else self.sketch.to_json()})
+
+    @classmethod
+    def from_json(cls, text):
+        """
+        Args:
+            text: string returned by to_json()
+        Returns:
+            DataAccumulator with the same statistics
+        """
+        fields = json.loads(text)
+        sketch = None
+        if fields["sketch"] is not None:
+            sketch = QuantileSketch.from_json(fields["sketch"])
+        accumulator = cls(fields["resolution"], sketch)
+        accumulator.count = fields["count"]
+        accumulator.mean = fields["mean"]
+        accumulator.m2 = fields["m2"]
+        if accumulator.count:
+            accumulator.minimum = fields["minimum"]
+            accumulator.maximum = fields["maximum"]
+        accumulator.counts = {item: freq for (item, freq) in fields["counts"]}
+        return accumulator
+
+class QuantileSketch:
+    """
+    KLL quantile sketch (Karnin, Lang and Liberty): approximate quantiles of
+        an unbounded stream in bounded memory
+    Values are kept in a stack of levels; a value on level h stands for 2**h
+        values of the stream. When a level is full it is sorted and every
+        other value (starting at a random one of the first two) moves up a
+        level. Capacities shrink by 2/3 per level below the top, down to
+        MIN_CAPACITY (so the lowest levels are not sorted every few values).
+        Memory stays below about 3 * k values plus MIN_CAPACITY per level,
+        with about log2(count / k) levels, and the rank of a reported
+        quantile is typically off by no more than about 1 / k of the count
+        (k = 200 gives roughly 0.5%).
+    Public data attributes:
+        k: int, accuracy parameter (capacity of the top level)
+        count: int, number of values added
+        minimum, maximum: floats, smallest and largest values added (exact)
+    """
+
+    MIN_CAPACITY = 32
+
+    def __init__(self, k=200, seed=None):
+        """
+        Args:
+            k: int, at least 8; larger is more accurate and uses more memory
+            seed: optional seed for the choice of the values kept, to make
+                the results reproducible
+        """
+        if k < 8:
+            raise ValueError("sketch accuracy k must be at least 8")
+        self.k = k
+        self.count = 0
+        self.minimum = float('inf')
+        self.maximum = float('-inf')
+        self.levels = [[]]
+        self._rng = random.Random(seed)
+
+    def _capacity(self, level):
+        """number of values 'level' may hold before it is compacted"""
+        depth = len(self.levels) - level - 1
+        return max(int(math.ceil(self.k * (2.0 / 3.0) ** depth)),
+                   min(self.k, self.MIN_CAPACITY))
+
+    def _compress(self):
+        """compacts every level that has reached its capacity"""
+        level = 0
+        while level < len(self.levels):
+            if len(self.levels[level]) >= self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append([])
+                items = sorted(self.levels[level])
+                # an odd one out (the largest) stays behind on this level
+                keep = [items.pop()] if len(items) % 2 else []
+                self.levels[level + 1].extend(items[self._rng.randrange(2)::2])
+                self.levels[level] = keep
+            level += 1
+
+    def add(self, item):
+        """
+        adds one value to the sketch
+        Args:
+            item: float
+        """
+        self.update((item,))
+
+    def update(self, items):
+        """
+        adds every value of an iterable to the sketch
+        Args:
+            items: iterable of floats
+        Returns:
+            the sketch itself
+        """
+        items = iter(items)
+        while True:
+            # fill the bottom level in one step rather than item by item
+            bottom = self.levels[0]
+            batch = list(itertools.islice(items, self._capacity(0) - len(bottom)))
+            if not batch:
+                return self
+            self.count += len(batch)
+            self.minimum = min(self.minimum, min(batch))
+            self.maximum = max(self.maximum, max(batch))
+            bottom.extend(batch)
+            if len(bottom) >= self._capacity(0):
+                self._compress()
+
+    def feed(self, items):
+        """
+        adds the values of an iterable to the sketch as they are consumed,
+            so that another single-pass computation can use them as well
+        Args:
+            items: iterable of floats
+        Returns:
+            generator passing on every value of 'items'
+        """
+        bottom = self.levels[0]
+        capacity = self._capacity(0)
+        for item in items:
+            self.count += 1
+            if item < self.minimum:
+                self.minimum = item
+            if item > self.maximum:
+                self.maximum = item
+            bottom.append(item)
+            if len(bottom) >= capacity:
+                self._compress()
+                bottom = self.levels[0]
+                capacity = self._capacity(0)
+            yield item
+
+    def merge(self, other):
+        """
+        adds the values summarized by another sketch, as if they had been
+            added to this one
+        Args:
+            other: QuantileSketch with the same k
+        Returns:
+            the sketch itself
+        """
+        if other.k != self.k:
+            raise ValueError("cannot merge sketches with different k")
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for level, items in enumerate(other.levels):
+            self.levels[level].extend(items)
+        self.count += other.count
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+        while any(len(items) >= self._capacity(level)
+                  for level, items in enumerate(self.levels)):
+            self._compress()
+        return self
+
+    def quantiles(self, fractions):
+        """
+        approximate quantiles of the values added
+        Args:
+            fractions: list of floats between 0 and 1, e.g. [0.5, 0.9, 0.99]
+        Returns:
+            list of floats, one value of the stream per fraction (0 gives
+                the minimum and 1 the maximum exactly)
+        """
+        if self.count == 0:
+            raise ValueError("no values to compute a quantile of")
+        weighted = sorted((item, 1 << level)
+                          for level, items in enumerate(self.levels) for item in items)
+        total = sum(weight for item, weight in weighted)
+        results = []
+        for fraction in fractions:
+            if fraction <= 0.0:
+                results.append(self.minimum)
+                continue
+            if fraction >= 1.0:
+                results.append(self.maximum)
+                continue
+            target = fraction * total
+            seen = 0
+            for item, weight in weighted:
+                seen += weight
+                if seen >= target:
+                    break
+            results.append(item)
+        return results
+
+    def quantile(self, fraction):
+        """
+        Args:
+            fraction: float between 0 and 1
+        Returns:
+            float, approximate quantile of the values added
+        """
+        return self.quantiles([fraction])[0]
+
+    def to_json(self):
+        """
+        Returns:
+            string, JSON text from which from_json() rebuilds the sketch
+        """
+        return json.dumps({"k": self.k, "count": self.count,
+                           "minimum": self.minimum if self.count else None,
+                           "maximum": self.maximum if self.count else None,
+                           "levels": self.levels})
+
+    @classmethod
+    def from_json(cls, text, seed=None):
+        """
+        Args:
+            text: string returned by to_json()
+            seed: as for __init__, for the values kept from now on
+        Returns:
+            QuantileSketch summarizing the same values
+        """
+        fields = json.loads(text)
+        sketch = cls(fields["k"], seed)
+        sketch.count = fields["count"]
+        if sketch.count:
+            sketch.minimum = fields["minimum"]
+            sketch.maximum = fields["maximum"]
+        sketch.levels = fields["levels"]
+        return sketch
@@ -4,15 +4,28 @@ Authors: Christopher Johnson
 """
 
 import math
-import random
+import bisect
 import argparse
 from data import *
+from eqevents import read_events, iter_event_chunks, EventTable
+from eqcluster import kmeans, labels_to_clusters, kmeans_plus_plus, best_of_restarts
+from eqcluster import assign, minibatch_kmeans
+from eqindex import GridIndex
+from eqrender import read_gif, write_image, draw_classes, shade_grid
+from eqtime import TimeIndex, parse_time, format_time, SECONDS_PER_DAY
+import numpy as np
 import turtle
 import sys
 
 # constants for the k-means clustering algorithm
 NO_OF_CLUSTERS = 6
-NO_OF_ITERATIONS = 7
+NO_OF_ITERATIONS = 100      # upper limit, clustering stops once it converges
+CLUSTER_TOLERANCE = 1e-9    # converged when no centroid moves farther (degrees)
+
+# constants for streaming (mini-batch) clustering of files larger than memory
+STREAM_CHUNK_SIZE = 100000  # events read from the file at a time
+BATCH_SIZE = 1024           # events per centroid update
+NO_OF_PASSES = 3            # passes over the file before the final assignment
 
 def euclid_distance(point1, point2):
     """
@@ -31,76 +44,128 @@ def euclid_distance(point1, point2):
 
     return math.sqrt(total)
 
-def create_centroids(k, datadict):
+def create_centroids(k, datadict, seed=None):
     """
-    randomly selects 'k' points from 'datadict' as the starting
-        centroids for the k-means clustering algorithm
+    selects 'k' events from 'datadict' as the starting centroids for the
+        k-means clustering algorithm, using k-means++: after a random first
+        event, each next one is picked with probability proportional to its
+        squared distance from the closest centroid already chosen, so the
+        centroids are spread out and no location is picked twice
     Args:
         k: int, number of clusters desired
-        datadict: list of lists, each contained list represents an EQ event
+        datadict: EventTable or dictionary of EQ events
+        seed: int or None, seed for the random choices (same seed, same
+              centroids)
     Returns:
         list of lists, each contained list is an event to act as the centroid
     """
-    centroids = []
-    count = 0
-    centroid_keys = []
-
-    while count < k:
-        rkey = random.randint(1, len(datadict))
-        if rkey not in centroid_keys:
-            centroids.append(datadict[rkey])
-            centroid_keys.append(rkey)
-            count += 1
+    points, keys = event_points(datadict)
+    chosen = kmeans_plus_plus(points, k, np.random.default_rng(seed))
+    return [datadict[int(keys[index])] for index in chosen]
 
-    return centroids
+def event_points(datadict):
+    """
+    the locations of the events in 'datadict' as arrays
+    Args:
+        datadict: EventTable, or dictionary of EQ events as from read_file
+    Returns:
+        tuple (points, keys): points is a NumPy array with one [lon, lat] row
+            per event, keys a NumPy array of the matching keys of 'datadict'
+    """
+    if isinstance(datadict, EventTable):
+        return datadict.points(), np.arange(1, len(datadict) + 1)
+    keys = np.array(list(datadict), dtype=np.int64)
+    points = np.array([datadict[key][:2] for key in datadict], dtype=np.float64)
+    return points.reshape(len(keys), 2), keys
 
-def create_clusters(k, centroids, datadict, iterations):
+def create_clusters(k, centroids, datadict, iterations, tolerance=CLUSTER_TOLERANCE):
     """
     k-means clustering algorithm - implementation taken from page 249 of
-        ranum and miller text, with some modifications
+        ranum and miller text, with some modifications; the distance and
+        centroid computations are vectorized (see eqcluster.py), and events
+        are assigned to centroids a grid cell at a time (see eqindex.py)
     Args:
         k: integer, number of clusters
-        centroids: list of events, each event is the centroid of its cluster
-        datadict: dictionary of all EQ events
-        iterations: int, number of clustering iterations to perform
+        centroids: list of events, each event is the centroid of its cluster;
+                   updated in place to the final [lon, lat] centroids
+        datadict: EventTable or dictionary of all EQ events
+        iterations: int, maximum number of clustering iterations to perform
+        tolerance: float, clustering stops early once no centroid moves
+                   farther than this between iterations
     Returns:
         list of lists: each contained list is the set of indices into 'datadict'
            for events that belong to that cluster
     """
-    for iteration in range(iterations):
-        clusters = []
-        for i in range(k):
-            clusters.append([])
-
-        for key in datadict:
-            distances = []
-            for cl_index in range(k):
-                dist = euclid_distance(datadict[key], centroids[cl_index])
-                distances.append(dist)
-            min_dist = min(distances)
-            index = distances.index(min_dist)
-            clusters[index].append(key)
-
-        dimensions = 2
-        for cl_index in range(k):
-            sums = [0]*dimensions
-            for key in clusters[cl_index]:
-                data_points = datadict[key]
-                for ind in range(2):
-                    sums[ind] = sums[ind] + data_points[ind]
-            for ind in range(len(sums)):
-                cl_len = len(clusters[cl_index])
-                if cl_len != 0:
-                    sums[ind] /= cl_len
-            centroids[cl_index] = sums
-    return clusters
+    points, keys = event_points(datadict)
+    start = [centroid[:2] for centroid in centroids[:k]]
+    index = GridIndex(points[:, 0], points[:, 1])
+    labels, final, runs, inertia = kmeans(points, start, iterations, tolerance,
+                                          index.assign)
+    for cl_index in range(k):
+        centroids[cl_index] = final[cl_index].tolist()
+    return labels_to_clusters(labels, keys, k)
+
+def create_best_clusters(k, datadict, iterations, restarts, seed=None,
+                         workers=None, tolerance=CLUSTER_TOLERANCE):
+    """
+    runs 'restarts' independent k-means++ seeded clusterings in a process
+        pool and keeps the one with the lowest inertia (sum of squared
+        distances from events to their centroids)
+    Args:
+        k, datadict, iterations, tolerance: as for create_clusters
+        restarts: int, number of clusterings to try
+        seed: int or None, seed for the whole set of restarts
+        workers: int or None, number of processes (default: one per CPU)
+    Returns:
+        list of lists, as for create_clusters
+    """
+    points, keys = event_points(datadict)
+    labels, centroids, inertia = best_of_restarts(points, k, restarts, iterations,
+                                                  tolerance, seed, workers)
+    return labels_to_clusters(labels, keys, k)
+
+def stream_clusters(k, filename, out_filename, seed=None,
+                    chunk_size=STREAM_CHUNK_SIZE, batch_size=BATCH_SIZE,
+                    passes=NO_OF_PASSES):
+    """
+    mini-batch k-means clustering of a file that need not fit in memory:
+        the file is read chunk by chunk for 'passes' passes of centroid
+        updates, then once more to assign every event to its cluster
+    Args:
+        k: integer, number of clusters
+        filename: string, name of a CSV file containing the EQ data
+        out_filename: string, name of the file to write the assignments to,
+                      one "record number,cluster" line per event, numbered
+                      from 1 like the keys of read_file
+        seed: int or None, seed for choosing the starting centroids
+        chunk_size, batch_size, passes: see the constants above
+    Returns:
+        tuple (centroids, sizes): list of the final [lon, lat] centroids and
+            list of the number of events in each cluster
+    """
+    def chunk_points():
+        return (chunk.points() for chunk in iter_event_chunks(filename, chunk_size))
+
+    centroids, counts = minibatch_kmeans(chunk_points, k, batch_size, passes, seed)
+    sizes = np.zeros(k, dtype=np.int64)
+    record = 1
+    with open(out_filename, "w") as out:
+        for points in chunk_points():
+            labels, sq_dists = assign(points, centroids)
+            sizes += np.bincount(labels, minlength=k)
+            records = np.arange(record, record + len(points))
+            out.writelines("{},{}\n".format(*pair)
+                           for pair in zip(records.tolist(), labels.tolist()))
+            record += len(points)
+    return centroids.tolist(), sizes.tolist()
 
 def read_file(filename):
     """
     read the EQ events from the csv file, 'filename'; any lines starting with
-        # are skipped; the longitude, latitude, magnitude, and depth (in miles)
-        is extracted from each event record, and stored as a list against its
-        record number in a dictionary
+        # are skipped; the longitude, latitude, magnitude, depth (in miles)
+        and epoch time (seconds since 1970-01-01 UTC) is extracted from each
+        event record, and stored as a list against its record number in a
+        dictionary
     Args:
         filename: string, name of a CSV file containing the EQ data
     Returns:
@@ -120,7 +185,8 @@ def read_file(filename):
         lon = float(values[8])
         mag = float(values[1])
         dep = float(values[10])
-        dict[key] = [lon, lat, mag, dep]
+        time = float(values[2])
+        dict[key] = [lon, lat, mag, dep, time]
     fd.close()
     return dict
 
@@ -140,6 +206,26 @@ size_y = 0
 left_x = 0
 bot_y = 0
 
+BASEMAP = "PacificNW.gif"
+
+# dot colors and sizes of the plots, by cluster and by magnitude/depth bin
+# (see bin_value)
+CLUSTER_COLORS = ["violet","blue","green","yellow","orange","red"]
+MAG_COLORS = ["violet","purple","DarkBlue","powder blue","light green","dark green","yellow","orange","red"]
+MAG_SIZES = [4,7,9,12,15,18,20,23,26,29,33]
+MAG_BOUNDS = [1.0,2.0,3.0,4.0,5.0,6.0,7.0,8.0,9.0]
+MILE_COLORS = ["red","dark orange","orange","yellow","green yellow","green","light green","powder blue","dark blue","purple","violet"]
+MILE_SIZES = [30,26,22,20,18,16,13,10,7,5,3]
+MILE_BOUNDS = [1.0,5.0,10.0,15.0,20.0,25.0,30.0,35.0,40.0,45.0,50.0]
+
+# density plots: cell size, and cell colors by number of events in the cell
+DENSITY_CELL_SIZE = 0.2     # degrees of longitude and latitude
+DENSITY_COLORS = ["violet","purple","DarkBlue","powder blue","light green","dark green","yellow","orange","red"]
+DENSITY_BOUNDS = [1,2,5,10,20,50,100,200]
+DENSITY_OPACITY = 0.6       # rendered cells let the map show through
+
+TIMELINE_WINDOW_DAYS = 7    # length of the windows of "analyze timeline"
+
 def prepare_turtle():
     """
     Prepares the turtle and the window to plot magnitudes, depths, or clusters
@@ -150,23 +236,32 @@ def prepare_turtle():
         data needed for plot_routines
     """
     global eq_turtle, eq_win
-    global left_lon, right_lon, top_lat, bot_lat
-    global lon_diff, lat_diff
-    global size_x, size_y, left_x, bot_y
 
     eq_turtle = turtle.Turtle()
     eq_turtle.speed(10)
     eq_win = turtle.Screen()
     eq_win.screensize(655,808)	# number of pixels in map
+    set_map_size(*eq_win.screensize())
+    eq_win.bgpic(BASEMAP)	# PNW map
+    eq_turtle.hideturtle()
+    eq_turtle.up()
+
+def set_map_size(width, height):
+    """
+    defines the global data xy_calculate needs for a map of the given size
+    Args:
+        width, height: ints, size of the map in pixels
+    """
+    global left_lon, right_lon, top_lat, bot_lat
+    global lon_diff, lat_diff
+    global size_x, size_y, left_x, bot_y
+
     lon_diff = right_lon - left_lon
     lat_diff = top_lat - bot_lat
-    size_x = eq_win.screensize()[0]
+    size_x = width
     left_x = -size_x/2
-    size_y = eq_win.screensize()[1]
+    size_y = height
     bot_y = -size_y/2
-    eq_win.bgpic("PacificNW.gif")	# PNW map
-    eq_turtle.hideturtle()
-    eq_turtle.up()
 
 def xy_calculate(lon, lat):
     """
@@ -174,6 +269,7 @@ def xy_calculate(lon, lat):
     Args:
         lon: float, longitude value for point on map
         lat: float, latitude value for point on map
+             (or NumPy arrays of longitudes and latitudes)
     Returns:
         tuple, corresponding pixel x and y values for use in turtle methods
     """
@@ -199,9 +295,8 @@ def plot_clusters(eq_clusters, eq_dict):
     """
     global eq_turtle
     ct = 0  
-    my_colors = ["violet","blue","green","yellow","orange","red"] 
     for i in eq_clusters:
-        tcolor = my_colors[ct] 
+        tcolor = CLUSTER_COLORS[ct] 
         ct += 1 
         for j in i:
             val = eq_dict[j] 
@@ -221,11 +316,50 @@ def bin_value(value, bounds):
     Returns:
         integer, index of smallest value of bounds[] that is >= value
             if value > bounds[-1], returns len(bounds)
+            if value is NaN, returns len(bounds) + 1, a bin of its own
+    """
+    if math.isnan(value):
+        return len(bounds) + 1
+    return bisect.bisect_left(bounds, value)
+
+def bin_values(values, bounds):
     """
-    for i in range(len(bounds)):
-        if value <= bounds[i]:
-            return i
-    return len(bounds)
+    bin_value for a whole column of values at once
+    Args:
+        values: NumPy array or iterable of floats
+        bounds: list of floats, as for bin_value
+    Returns:
+        tuple (bins, counts): bins is a NumPy int array with
+            bins[i] == bin_value(values[i], bounds), and counts[b] is the
+            number of values in bin b, for the len(bounds) + 1 bins; NaN
+            values, in bin len(bounds) + 1, are left out of counts
+    """
+    if not isinstance(values, np.ndarray):
+        values = np.fromiter(values, dtype=np.float64)
+    bins = np.searchsorted(bounds, values, side='left')
+    # searchsorted puts NaN after every bound; give it bin_value's bin
+    bins[np.isnan(values)] = len(bounds) + 1
+    return bins, np.bincount(bins, minlength=len(bounds) + 2)[:len(bounds) + 1]
+
+def bin_table(bounds, counts, unit=""):
+    """
+    prints the number of values in each bin
+    Args:
+        bounds: list of floats, as for bin_value
+        counts: per-bin counts, as from bin_values
+        unit: string appended to the bounds, e.g. " miles"
+    Outputs:
+        frequency table of the bins printed on the standard output
+    """
+    print("BIN                     FREQUENCY")
+    for i in range(len(counts)):
+        if i == 0:
+            label = "<= {}{}".format(bounds[0], unit)
+        elif i < len(bounds):
+            label = "{} - {}{}".format(bounds[i-1], bounds[i], unit)
+        else:
+            label = "> {}{}".format(bounds[-1], unit)
+        print('{:22}  {:9}'.format(label, counts[i]))
 
 def plot_magnitudes(eq_dict):
     """
@@ -238,20 +372,22 @@ def plot_magnitudes(eq_dict):
         eq_dict: list of lists, each contained list represents an EQ event
     Outputs:
         plots magnitude of all events as dots on the map
+    Returns:
+        NumPy array, number of events in each magnitude bin (see bin_values)
     """
     global eq_turtle
-    mag_colors = ["violet","purple","DarkBlue","powder blue","light green","dark green","yellow","orange","red"] s
-    mag_sizes = [4,7,9,12,15,18,20,23,26,29,33] 
-    mag_bounds = [1.0,2.0,3.0,4.0,5.0,6.0,7.0,8.0,9.0] 
-    for i in eq_dict:
+    bins, counts = bin_values(event_array(eq_dict, 2), MAG_BOUNDS)
+    # events past the last bound get the last color and size
+    styles = np.minimum(bins, len(MAG_COLORS) - 1).tolist()
+    for (i, style, b) in zip(eq_dict, styles, bins.tolist()):
+        if b > len(MAG_BOUNDS):
+            continue    # no magnitude given
         magset = eq_dict[i]
-        magnitude = magset[2] 
         (lon,lat) = magset[:2] 
         (a,b) = xy_calculate(lon,lat) 
         eq_turtle.goto(a,b) 
-        m_color = mag_colors[bin_value(magnitude,mag_bounds)] 
-        m_size = mag_sizes[bin_value(magnitude,mag_bounds)] 
-        eq_turtle.dot(m_size, m_color) 
+        eq_turtle.dot(MAG_SIZES[style], MAG_COLORS[style]) 
+    return counts
 
 def plot_depths(eq_dict):
     """
@@ -265,65 +401,312 @@ def plot_depths(eq_dict):
         eq_dict: list of lists, each contained list represents an EQ event
     Outputs:
         plots depth of all events as dots on the map
+    Returns:
+        NumPy array, number of events in each depth bin (see bin_values)
     """
     global eq_turtle
-    mile_colors = ["red","dark orange","orange","yellow","green yellow","green","light green","powder blue","dark blue","purple","violet"]
-    mile_sizes = [30,26,22,20,18,16,13,10,7,5,3] 
-    mile_bounds = [1.0,5.0,10.0,15.0,20.0,25.0,30.0,35.0,40.0,45.0,50.0] 
-    for i in eq_dict:
+    bins, counts = bin_values(event_array(eq_dict, 3), MILE_BOUNDS)
+    styles = np.minimum(bins, len(MILE_COLORS) - 1).tolist()
+    for (i, style, b) in zip(eq_dict, styles, bins.tolist()):
+        if b > len(MILE_BOUNDS):
+            continue    # no depth given
         depset = eq_dict[i] 
-        depth = depset[3] 
         (lon,lat) = depset[:2] 
         (a,b) = xy_calculate(lon,lat)
         eq_turtle.goto(a,b)
-        d_color = mile_colors[bin_value(depth,mile_bounds)]
-        d_size = mile_sizes[bin_value(depth,mile_bounds)]
-        eq_turtle.dot(d_size,d_color)
+        eq_turtle.dot(MILE_SIZES[style], MILE_COLORS[style])
+    return counts
+
+def density_grid(eq_dict, cell_size=DENSITY_CELL_SIZE):
+    """
+    aggregates the events into square lon/lat cells covering the map, in one
+        pass over the event arrays; events off the map are left out
+    Args:
+        eq_dict: EventTable or dictionary of EQ events
+        cell_size: float, side of a cell in degrees
+    Returns:
+        dictionary of NumPy arrays with one entry per non-empty cell, most
+            events first: 'col' and 'row' (cell position, counted from the
+            map's west and south edges), 'lon' and 'lat' (cell centre),
+            'count', 'mean_mag' and 'max_depth'; and 'shape', the
+            (rows, columns) of the whole grid
+    """
+    lon = event_array(eq_dict, 0)
+    lat = event_array(eq_dict, 1)
+    mag = event_array(eq_dict, 2)
+    depth = event_array(eq_dict, 3)
+    ncols = int(math.ceil((right_lon - left_lon) / cell_size))
+    nrows = int(math.ceil((top_lat - bot_lat) / cell_size))
+    col = np.floor((lon - left_lon) / cell_size).astype(np.intp)
+    row = np.floor((lat - bot_lat) / cell_size).astype(np.intp)
+    on_map = (col >= 0) & (col < ncols) & (row >= 0) & (row < nrows)
+    cell = row[on_map] * ncols + col[on_map]
+    counts = np.bincount(cell, minlength=nrows * ncols)
+    mag_sums = np.bincount(cell, weights=mag[on_map], minlength=nrows * ncols)
+    max_depths = np.full(nrows * ncols, -np.inf)
+    np.maximum.at(max_depths, cell, depth[on_map])
+    occupied = np.flatnonzero(counts)
+    occupied = occupied[np.argsort(-counts[occupied], kind='stable')]
+    cols, rows = occupied % ncols, occupied // ncols
+    return {'col': cols, 'row': rows,
+            'lon': left_lon + (cols + 0.5) * cell_size,
+            'lat': bot_lat + (rows + 0.5) * cell_size,
+            'count': counts[occupied],
+            'mean_mag': mag_sums[occupied] / counts[occupied],
+            'max_depth': max_depths[occupied],
+            'shape': (nrows, ncols)}
+
+def plot_density(eq_dict, cell_size=DENSITY_CELL_SIZE):
+    """
+    plot the event density - fill each map cell that has events with a
+        color for its number of events (see DENSITY_BOUNDS); the number of
+        turtle calls grows with the number of cells, not of events
+    Args:
+        eq_dict: EventTable or dictionary of EQ events
+        cell_size: float, side of a cell in degrees
+    Outputs:
+        plots the non-empty cells as filled squares on the map
+    Returns:
+        NumPy array, number of cells in each density bin (see bin_values)
+    """
+    global eq_turtle
+    grid = density_grid(eq_dict, cell_size)
+    bins, counts = bin_values(grid['count'], DENSITY_BOUNDS)
+    for (lon, lat, style) in zip(grid['lon'].tolist(), grid['lat'].tolist(),
+                                 bins.tolist()):
+        half = cell_size / 2
+        corners = [xy_calculate(lon + dx, lat + dy)
+                   for (dx, dy) in ((-half,-half), (half,-half), (half,half), (-half,half))]
+        eq_turtle.goto(corners[0])
+        eq_turtle.fillcolor(DENSITY_COLORS[style])
+        eq_turtle.begin_fill()
+        for corner in corners[1:]:
+            eq_turtle.goto(corner)
+        eq_turtle.end_fill()
+    return counts
+
+def analyze_density(eq_dict, cell_size=DENSITY_CELL_SIZE):
+    """
+    Print the event density of the map cells
+    Args:
+        eq_dict: EventTable or dictionary of EQ events
+        cell_size: float, side of a cell in degrees
+    Outputs:
+        for each cell with events, most events first: centre, number of
+            events, mean magnitude and maximum depth
+    """
+    grid = density_grid(eq_dict, cell_size)
+    print("{} events in {} of {} cells of {} degrees".format(
+        int(grid['count'].sum()), len(grid['count']),
+        grid['shape'][0] * grid['shape'][1], cell_size))
+    print("     LON      LAT   EVENTS  MEAN MAG  MAX DEPTH")
+    for (lon, lat, count, mag, depth) in zip(grid['lon'], grid['lat'], grid['count'],
+                                             grid['mean_mag'], grid['max_depth']):
+        print("{:8.2f} {:8.2f} {:8d} {:9.2f} {:10.1f}".format(lon, lat, count, mag, depth))
+
+def event_pixels(eq_dict, basemap):
+    """
+    positions of the events on a raster image of the map
+    Args:
+        eq_dict: EventTable or dictionary of EQ events as from read_file
+        basemap: NumPy image array of the map (see eqrender.read_gif)
+    Returns:
+        tuple (cols, rows) of NumPy float arrays, the pixel column and row of
+            each event, in the order of 'eq_dict'
+    """
+    set_map_size(basemap.shape[1], basemap.shape[0])
+    points, keys = event_points(eq_dict)
+    (x, y) = xy_calculate(points[:, 0], points[:, 1])
+    # turtle coordinates have their origin in the centre and y upwards
+    return (x - left_x, bot_y + size_y - y)
+
+def render_events(what, eq_dict, out_filename, eq_clusters=None,
+                  cell_size=DENSITY_CELL_SIZE):
+    """
+    headless counterpart of plot_clusters, plot_magnitudes, plot_depths and
+        plot_density: draws every event onto the basemap with the same
+        colors and sizes, one vectorized pass per color and size, and writes
+        a PNG or PPM file
+    Args:
+        what: string, one of clusters, magnitudes, depths, density
+        eq_dict: EventTable or dictionary of EQ events
+        out_filename: string, image file to write (.ppm for PPM, else PNG)
+        eq_clusters: list of lists, as from create_clusters, for 'clusters'
+        cell_size: float, side of a cell in degrees, for 'density'
+    Outputs:
+        the image file
+    Returns:
+        NumPy array of the number of events (cells, for density) in each
+            bin (see bin_values), or None for clusters
+    """
+    image = read_gif(BASEMAP)
+    counts = None
+    if what == 'density':
+        grid = density_grid(eq_dict, cell_size)
+        bins, counts = bin_values(grid['count'], DENSITY_BOUNDS)
+        cell_classes = np.full(grid['shape'], -1, dtype=np.intp)
+        cell_classes[grid['row'], grid['col']] = bins
+        # the grid cell under the centre of every pixel
+        (height, width) = image.shape[:2]
+        pixel_cols = np.floor((np.arange(width) + 0.5) / width
+                              * (right_lon - left_lon) / cell_size).astype(np.intp)
+        pixel_rows = np.floor((height - np.arange(height) - 0.5) / height
+                              * (top_lat - bot_lat) / cell_size).astype(np.intp)
+        shade_grid(image, np.minimum(pixel_rows, grid['shape'][0] - 1),
+                   np.minimum(pixel_cols, grid['shape'][1] - 1), cell_classes,
+                   DENSITY_COLORS, DENSITY_OPACITY)
+        write_image(out_filename, image)
+        return counts
+    cols, rows = event_pixels(eq_dict, image)
+    if what == 'clusters':
+        # keys as from read_file / EventTable, in the order of eq_dict
+        position = {key: index for index, key in enumerate(eq_dict)}
+        classes = np.empty(len(cols), dtype=np.intp)
+        for ct, cluster in enumerate(eq_clusters):
+            classes[[position[key] for key in cluster]] = ct
+        draw_classes(image, cols, rows, classes, None, CLUSTER_COLORS)
+    elif what == 'magnitudes':
+        classes, counts = bin_values(event_array(eq_dict, 2), MAG_BOUNDS)
+        # events without a magnitude are not drawn; those past the last
+        # bound get the last color and size
+        known = classes <= len(MAG_BOUNDS)
+        classes = np.minimum(classes[known], len(MAG_COLORS) - 1)
+        draw_classes(image, cols[known], rows[known], classes, MAG_SIZES, MAG_COLORS)
+    else:
+        classes, counts = bin_values(event_array(eq_dict, 3), MILE_BOUNDS)
+        known = classes <= len(MILE_BOUNDS)
+        classes = np.minimum(classes[known], len(MILE_COLORS) - 1)
+        draw_classes(image, cols[known], rows[known], classes, MILE_SIZES, MILE_COLORS)
+    write_image(out_filename, image)
+    return counts
     
 
-def analyze_depths(eq_dict):
+def event_values(eq_dict, field):
+    """
+    the values of one field of every event, without building a list
+    Args:
+        eq_dict: EventTable or dictionary of EQ events as from read_file
+        field: int, position in an event's [lon, lat, mag, depth, time] list
+    Returns:
+        iterator of floats, in the order of 'eq_dict'
+    """
+    if isinstance(eq_dict, EventTable):
+        return map(float, event_array(eq_dict, field))
+    return (eq_dict[key][field] for key in eq_dict)
+
+def event_array(eq_dict, field):
+    """
+    the values of one field of every event as a NumPy array; for an
+        EventTable this is its column itself, not a copy
+    Args:
+        eq_dict, field: as for event_values
+    Returns:
+        NumPy float array, in the order of 'eq_dict'
+    """
+    if isinstance(eq_dict, EventTable):
+        return (eq_dict.lon, eq_dict.lat, eq_dict.mag, eq_dict.depth, eq_dict.time)[field]
+    return np.fromiter(event_values(eq_dict, field), dtype=np.float64,
+                       count=len(eq_dict))
+
+def filter_time(eq_dict, since=None, until=None):
+    """
+    the events in a time range, found by binary search on the sorted times
+    Args:
+        eq_dict: EventTable or dictionary of EQ events
+        since, until: times in seconds since 1970-01-01 UTC, or None for no
+                      limit; the range includes 'since' but not 'until'
+    Returns:
+        EventTable (or dictionary, for a dictionary) of the events in the
+            range, in their original order
+    """
+    index = TimeIndex(event_array(eq_dict, 4), event_array(eq_dict, 2))
+    positions = np.sort(index.positions(-np.inf if since is None else since,
+                                        np.inf if until is None else until))
+    if isinstance(eq_dict, EventTable):
+        return eq_dict.take(positions)
+    keys = list(eq_dict)
+    return {keys[position]: eq_dict[keys[position]] for position in positions}
+
+def analyze_timeline(eq_dict, window_days=TIMELINE_WINDOW_DAYS, since=None, until=None):
+    """
+    Perform statistical analysis on the events in consecutive time windows
+    Args:
+        eq_dict: EventTable or dictionary of EQ events
+        window_days: float, length of each window in days
+        since, until: times in seconds since 1970-01-01 UTC where the windows
+                      start and end, or None for the first and last event
+    Outputs:
+        for each window: start date, number of events, events per day and
+            mean magnitude
+    """
+    index = TimeIndex(event_array(eq_dict, 4), event_array(eq_dict, 2))
+    if len(index) == 0:
+        print("No events")
+        return
+    window = window_days * SECONDS_PER_DAY
+    (starts, counts, mean_mags) = index.rolling(window, start=since, end=until)
+    if until is not None:
+        # 'until' is excluded, so the last window starts before it
+        last = np.searchsorted(starts, until, side='left')
+        (starts, counts, mean_mags) = (starts[:last], counts[:last], mean_mags[:last])
+    print("{} events from {} to {} UTC, in windows of {:g} days".format(
+        len(index), format_time(index.times[0]), format_time(index.times[-1]),
+        window_days))
+    print("WINDOW START (UTC)      EVENTS  EVENTS/DAY  MEAN MAG")
+    for (start, count, mean_mag) in zip(starts, counts, mean_mags):
+        print("{}  {:9d}  {:10.2f}  {:>8}".format(
+            format_time(start), count, count / window_days,
+            "-" if count == 0 else "{:.2f}".format(mean_mag)))
+
+def analyze_depths(eq_dict, percentiles=False):
     """
     Perform statistical analysis on the depth information in the dictionary
     Args:
         eq_dict: list of lists, each contained list represents an EQ event
+        percentiles: bool, also report percentiles from a QuantileSketch
     Outputs:
         mean, median, and standard deviation of depth data
+        50th, 90th and 99th percentiles of depth data, if asked for
         frequency table for the depth data
     """
-    depth_list = [] 
-    for i in eq_dict:
-        adep = eq_dict[i]
-        depth = adep[3]      
-        depth_list.append(depth)
-    depth_median = data_median(depth_list) 
-    (depth_mean, depth_variance) = data_mean_variance(depth_list) 
-    depth_standdev = math.sqrt(depth_variance)  
+    sketch = QuantileSketch() if percentiles else None
+    depth_stats = DataAccumulator(sketch=sketch).update(event_values(eq_dict, 3))
+    depth_median = depth_stats.median()
+    depth_mean = depth_stats.mean
+    depth_standdev = math.sqrt(depth_stats.variance())
     print("Mean depth = {:.1f} miles".format(depth_mean)) 
     print("Median depth = {:.1f} miles".format(depth_median))
     print("Standard deviation = {:.2f} miles".format(depth_standdev))
-    data_freq_table(depth_list) 
+    if percentiles:
+        (p50, p90, p99) = sketch.quantiles([0.5, 0.9, 0.99])
+        print("Percentiles p50 / p90 / p99 = {:.1f} / {:.1f} / {:.1f} miles".format(
+            p50, p90, p99))
+    depth_stats.freq_table()
 
-def analyze_magnitudes(eq_dict):
+def analyze_magnitudes(eq_dict, percentiles=False):
     """
     Perform statistical analysis on the magnitude information in the dictionary
     Args:
         eq_dict: list of lists, each contained list represents an EQ event
+        percentiles: bool, also report percentiles from a QuantileSketch
     Outputs:
         mean, median, and standard deviation of magnitude data
+        50th, 90th and 99th percentiles of magnitude data, if asked for
         frequency table for the magnitude data
     """
-    mag_list = [] 
-    for i in eq_dict:
-        amag = eq_dict[i] 
-        mag = amag[2]          
-        mag_list.append(mag)
-    mag_median = data_median(mag_list) 
-    (mag_mean, mag_variance) = data_mean_variance(mag_list) 
-    mag_standdev = math.sqrt(mag_variance)
+    sketch = QuantileSketch() if percentiles else None
+    mag_stats = DataAccumulator(sketch=sketch).update(event_values(eq_dict, 2))
+    mag_median = mag_stats.median()
+    mag_mean = mag_stats.mean
+    mag_standdev = math.sqrt(mag_stats.variance())
     print("Mean magnitude = {:.1f}".format(mag_mean))
     print("Median magnitude = {:.1f}".format(mag_median))
     print("Standard deviation = {:.2f}".format(mag_standdev))
-    data_freq_table(mag_list)
+    if percentiles:
+        (p50, p90, p99) = sketch.quantiles([0.5, 0.9, 0.99])
+        print("Percentiles p50 / p90 / p99 = {:.1f} / {:.1f} / {:.1f}".format(
+            p50, p90, p99))
+    mag_stats.freq_table()
     
 
 def analyze_clusters(eq_clusters, eq_dict):
@@ -341,17 +724,27 @@ def analyze_clusters(eq_clusters, eq_dict):
     """
     ct = 0
     for i in eq_clusters:
-        cluster_list_mag = []
-        cluster_list_dep = []
-        for j in i:
-            cval = eq_dict[j]
-            (mag, dep) = cval[2:]
-            cluster_list_mag.append(mag)
-            cluster_list_dep.append(dep)
-        mag_median = data_median(cluster_list_mag) 
+        if len(i) == 0:
+            # a cluster can end up empty when events share locations
+            ct += 1
+            continue
+        if isinstance(eq_dict, EventTable):
+            rows = np.asarray(i, dtype=np.intp) - 1
+            cluster_list_mag = eq_dict.mag[rows]
+            cluster_list_dep = eq_dict.depth[rows]
+        else:
+            cluster_list_mag = []
+            cluster_list_dep = []
+            for j in i:
+                cval = eq_dict[j]
+                (mag, dep) = cval[2:4]
+                cluster_list_mag.append(mag)
+                cluster_list_dep.append(dep)
+        # the lists belong to this function, so selection may reorder them
+        mag_median = data_select_median(cluster_list_mag)
         (mag_mean, mag_variance) = data_mean_variance(cluster_list_mag) 
         mag_standdev = math.sqrt(mag_variance) 
-        depth_median = data_median(cluster_list_dep) 
+        depth_median = data_select_median(cluster_list_dep)
         (depth_mean, depth_variance) = data_mean_variance(cluster_list_dep) 
         depth_standdev = math.sqrt(depth_variance) 
         print("Analysis of cluster {}".format(ct))
@@ -377,7 +770,33 @@ def main():
     parser.add_argument('command', type=str,
                  help='One of the following strings: plot analyze')
     parser.add_argument('what', type=str,
-                 help='One of the following strings: clusters depths magnitudes')
+                 help='One of the following strings: clusters depths magnitudes '
+                      'density timeline (analyze only)')
+    parser.add_argument('--seed', type=int, default=None,
+                 help='Random seed for choosing the starting cluster centroids')
+    parser.add_argument('--restarts', type=int, default=1,
+                 help='Number of clusterings to run in parallel, keeping the best')
+    parser.add_argument('--percentiles', action='store_true',
+                 help='With "analyze depths/magnitudes": also report the 50th, '
+                      '90th and 99th percentiles, estimated in bounded memory')
+    parser.add_argument('--cell', type=float, default=DENSITY_CELL_SIZE, metavar='DEGREES',
+                 help='Size of the map cells for "density" (default {})'.format(
+                     DENSITY_CELL_SIZE))
+    parser.add_argument('--since', type=parse_time, default=None, metavar='TIME',
+                 help='Only use events at or after TIME (UTC date YYYY-MM-DD '
+                      'or epoch seconds)')
+    parser.add_argument('--until', type=parse_time, default=None, metavar='TIME',
+                 help='Only use events before TIME')
+    parser.add_argument('--window', type=float, default=TIMELINE_WINDOW_DAYS, metavar='DAYS',
+                 help='Length of the windows of "timeline" (default {} days)'.format(
+                     TIMELINE_WINDOW_DAYS))
+    parser.add_argument('--render', metavar='IMAGE_FILE', default=None,
+                 help='With "plot": draw onto the map without a window and '
+                      'write IMAGE_FILE (.png, or .ppm)')
+    parser.add_argument('--minibatch', metavar='OUT_FILE', default=None,
+                 help='With "analyze clusters": cluster the file in chunks '
+                      'without loading it whole, writing each event\'s cluster '
+                      'to OUT_FILE')
     args = parser.parse_args()
     eq_file = args.eq_file
     cmd = args.command
@@ -385,30 +804,83 @@ def main():
     if cmd != 'plot' and cmd != 'analyze':
         print('Illegal command: {}; must be "plot" or "analyze"'.format(cmd))
         sys.exit(1)
-    if what != 'clusters' and what != 'magnitudes' and what != 'depths':
-        print('Can only process clusters, magnitudes, or depths')
+    if what not in ('clusters', 'magnitudes', 'depths', 'density', 'timeline'):
+        print('Can only process clusters, magnitudes, depths, density, or timeline')
+        sys.exit(1)
+    if what == 'timeline' and cmd != 'analyze':
+        print('timeline can only be analyzed')
         sys.exit(1)
-    eq_dict = read_file(eq_file)
-    prepare_turtle()
+    if args.minibatch is not None:
+        if cmd != 'analyze' or what != 'clusters':
+            print('--minibatch only applies to "analyze clusters"')
+            sys.exit(1)
+        if args.since is not None or args.until is not None:
+            print('--since and --until do not apply to --minibatch')
+            sys.exit(1)
+        centroids, sizes = stream_clusters(NO_OF_CLUSTERS, eq_file, args.minibatch,
+                                           args.seed)
+        for ct in range(NO_OF_CLUSTERS):
+            print("Cluster {}: {} events, centroid lon {:.4f} lat {:.4f}".format(
+                ct, sizes[ct], centroids[ct][0], centroids[ct][1]))
+        print("Cluster assignments written to {}".format(args.minibatch))
+        return
+    if args.render is not None and cmd != 'plot':
+        print('--render only applies to "plot"')
+        sys.exit(1)
+    eq_dict = read_events(eq_file)
+    if args.since is not None or args.until is not None:
+        eq_dict = filter_time(eq_dict, args.since, args.until)
+        if len(eq_dict) == 0:
+            print('No events in the time range')
+            return
     if what == 'clusters':
-        eq_centroids = create_centroids(NO_OF_CLUSTERS, eq_dict)
-        eq_clusters = create_clusters(NO_OF_CLUSTERS, eq_centroids, eq_dict, NO_OF_ITERATIONS)
+        k = min(NO_OF_CLUSTERS, len(eq_dict))
+        if k < NO_OF_CLUSTERS:
+            print('Only {} events; making {} clusters'.format(len(eq_dict), k))
+        if args.restarts > 1:
+            eq_clusters = create_best_clusters(k, eq_dict, NO_OF_ITERATIONS,
+                                               args.restarts, args.seed)
+        else:
+            eq_centroids = create_centroids(k, eq_dict, args.seed)
+            eq_clusters = create_clusters(k, eq_centroids, eq_dict, NO_OF_ITERATIONS)
     if cmd == 'plot':
-        if what == 'clusters':
-            plot_clusters(eq_clusters, eq_dict)
-        elif what == 'magnitudes':
-            plot_magnitudes(eq_dict)
+        if args.render is not None:
+            counts = render_events(what, eq_dict, args.render,
+                                   eq_clusters if what == 'clusters' else None,
+                                   args.cell)
+            print("ALL EVENTS HAVE BEEN RENDERED TO {}".format(args.render))
+        else:
+            prepare_turtle()
+            counts = None
+            if what == 'clusters':
+                plot_clusters(eq_clusters, eq_dict)
+            elif what == 'magnitudes':
+                counts = plot_magnitudes(eq_dict)
+            elif what == 'depths':
+                counts = plot_depths(eq_dict)
+            elif what == 'density':
+                counts = plot_density(eq_dict, args.cell)
+            print("ALL EVENTS HAVE BEEN PLOTTED")
+        # the bin counts come with the plot's classification of the events
+        if what == 'magnitudes':
+            bin_table(MAG_BOUNDS, counts)
         elif what == 'depths':
-            plot_depths(eq_dict)
-        print("ALL EVENTS HAVE BEEN PLOTTED")
-        eq_win.exitonclick()
+            bin_table(MILE_BOUNDS, counts, " miles")
+        elif what == 'density':
+            bin_table(DENSITY_BOUNDS, counts, " events/cell")
+        if args.render is None:
+            eq_win.exitonclick()
     else:
         if what == 'clusters':
             analyze_clusters(eq_clusters, eq_dict)
         elif what == 'magnitudes':
-            analyze_magnitudes(eq_dict)
+            analyze_magnitudes(eq_dict, args.percentiles)
         elif what == 'depths':
-            analyze_depths(eq_dict)
+            analyze_depths(eq_dict, args.percentiles)
+        elif what == 'density':
+            analyze_density(eq_dict, args.cell)
+        elif what == 'timeline':
+            analyze_timeline(eq_dict, args.window, args.since, args.until)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,266 @@
+"""
+eqcluster.py: vectorized k-means clustering of earthquake locations
+Authors: Christopher Johnson
+
+create_clusters() in eqanalysis.py used to call euclid_distance() once per
+event per centroid per iteration. kmeans() does the same work with NumPy:
+the distances from a block of events to all centroids are one array
+expression, and the new centroids are per-cluster sums from np.bincount.
+Iteration stops once no centroid moves by more than a tolerance, and a
+cluster that loses all its events is re-seeded at the event farthest from
+its own centroid instead of collapsing.
+
+Starting centroids are chosen with k-means++ (kmeans_plus_plus), which
+spreads them out and never picks the same location twice, and
+best_of_restarts() runs several independently seeded clusterings in a
+process pool and keeps the one with the lowest inertia.
+
+For catalogs too large to hold in memory, minibatch_kmeans() updates the
+centroids from a stream of small batches of events (Sculley's mini-batch
+k-means: each centroid moves toward the mean of its batch members with a
+step that shrinks as the number of events it has seen grows), so only one
+chunk of the file is ever loaded. A centroid that has not won any event
+yet is moved to the batch event farthest from its centroid.
+"""
+
+import multiprocessing
+
+import numpy as np
+
+BLOCK_SIZE = 65536      # events per block of the distance computation
+
+
+def assign(points, centroids):
+    """
+    assigns each point to its nearest centroid
+    Args:
+        points: NumPy array, shape (n, 2), one [lon, lat] row per event
+        centroids: NumPy array, shape (k, 2)
+    Returns:
+        tuple (labels, sq_dists): labels[i] is the index of the centroid
+            nearest to points[i], sq_dists[i] the squared distance to it;
+            a tie goes to the lowest index, and the distances are computed
+            as euclid_distance() in eqanalysis.py does, so the labels are
+            those of the original loop over events and centroids
+    """
+    labels = np.empty(len(points), dtype=np.intp)
+    sq_dists = np.empty(len(points))
+    for start in range(0, len(points), BLOCK_SIZE):
+        block = points[start:start + BLOCK_SIZE]
+        # dx*dx + dy*dy for all pairs at once, in euclid_distance()'s order
+        dists = np.zeros((len(block), len(centroids)))
+        for dim in range(points.shape[1]):
+            diffs = block[:, dim][:, np.newaxis] - centroids[:, dim][np.newaxis, :]
+            dists += diffs * diffs
+        # compared as square roots, like the original loop, since two
+        # different squares can round to the same root
+        nearest = np.sqrt(dists).argmin(axis=1)
+        labels[start:start + BLOCK_SIZE] = nearest
+        sq_dists[start:start + BLOCK_SIZE] = dists[np.arange(len(block)), nearest]
+    return labels, sq_dists
+
+
+def kmeans(points, centroids, max_iterations, tolerance=1e-9, assigner=None):
+    """
+    k-means clustering (Lloyd's algorithm)
+    Args:
+        points: NumPy array, shape (n, 2), one [lon, lat] row per event
+        centroids: array-like, shape (k, 2), the starting centroids
+        max_iterations: int, upper limit on the number of iterations
+        tolerance: float, stop when no centroid moves farther than this
+        assigner: function of a centroid array returning (labels, sq_dists)
+            for 'points' as assign() does, e.g. the assign method of an
+            eqindex.GridIndex over them; default assign(points, centroids)
+    Returns:
+        tuple (labels, centroids, iterations, inertia): labels[i] is the
+            cluster of points[i], centroids the final (k, 2) array,
+            iterations the number of iterations run, and inertia the sum of
+            squared distances from the events to their centroids
+    """
+    if assigner is None:
+        assigner = lambda centroids: assign(points, centroids)
+    centroids = np.array(centroids, dtype=np.float64)
+    k = len(centroids)
+    labels, sq_dists = assigner(centroids)
+    iterations = 0
+    while iterations < max_iterations:
+        iterations += 1
+        counts = np.bincount(labels, minlength=k)
+        sums = np.column_stack([np.bincount(labels, weights=points[:, dim], minlength=k)
+                                for dim in range(points.shape[1])])
+        new_centroids = centroids.copy()
+        occupied = counts > 0
+        new_centroids[occupied] = sums[occupied] / counts[occupied, np.newaxis]
+        for cluster in np.flatnonzero(~occupied):
+            # empty cluster: restart it at the worst-served event
+            farthest = sq_dists.argmax()
+            new_centroids[cluster] = points[farthest]
+            sq_dists[farthest] = 0.0
+        shift = np.sqrt(((new_centroids - centroids) ** 2).sum(axis=1)).max()
+        centroids = new_centroids
+        labels, sq_dists = assigner(centroids)
+        if shift <= tolerance:
+            break
+    return labels, centroids, iterations, float(sq_dists.sum())
+
+
+def labels_to_clusters(labels, keys, k):
+    """
+    converts cluster labels to the lists of keys create_clusters() returns
+    Args:
+        labels: NumPy int array, labels[i] is the cluster of the i-th event
+        keys: NumPy array, keys[i] is the key of the i-th event
+        k: int, number of clusters
+    Returns:
+        list of k lists; list c holds the keys of the events in cluster c
+    """
+    order = np.argsort(labels, kind="stable")
+    bounds = np.searchsorted(labels[order], np.arange(k + 1))
+    return [keys[order[bounds[c]:bounds[c + 1]]].tolist() for c in range(k)]
+
+
+def kmeans_plus_plus(points, k, rng):
+    """
+    k-means++ choice of starting centroids: the first is a random event, each
+        next one an event picked with probability proportional to its squared
+        distance from the nearest centroid chosen so far
+    Args:
+        points: NumPy array, shape (n, 2), one [lon, lat] row per event
+        k: int, number of centroids
+        rng: numpy.random.Generator
+    Returns:
+        NumPy int array of the k row numbers of 'points' chosen; if there are
+            fewer than k distinct locations, the remaining choices are random
+    """
+    if len(points) == 0:
+        raise ValueError("no events to choose starting centroids from")
+    chosen = [int(rng.integers(len(points)))]
+    sq_dists = ((points - points[chosen[0]]) ** 2).sum(axis=1)
+    while len(chosen) < k:
+        total = sq_dists.sum()
+        if total > 0.0:
+            index = int(np.searchsorted(np.cumsum(sq_dists), rng.random() * total,
+                                        side="right"))
+            index = min(index, len(points) - 1)
+        else:
+            index = int(rng.integers(len(points)))
+        chosen.append(index)
+        sq_dists = np.minimum(sq_dists, ((points - points[index]) ** 2).sum(axis=1))
+    return np.array(chosen)
+
+
+_restart_points = None
+
+def _init_restart(points):
+    """pool initializer: receive the events once per worker, not per task"""
+    global _restart_points
+    _restart_points = points
+
+def _restart(task):
+    """pool task: one seeded k-means++ and k-means run"""
+    seed, k, max_iterations, tolerance = task
+    points = _restart_points
+    rng = np.random.default_rng(seed)
+    start = points[kmeans_plus_plus(points, k, rng)]
+    labels, centroids, iterations, inertia = kmeans(points, start, max_iterations,
+                                                    tolerance)
+    return inertia, centroids, iterations
+
+def best_of_restarts(points, k, restarts, max_iterations, tolerance=1e-9,
+                     seed=None, workers=None):
+    """
+    runs 'restarts' k-means++ seeded clusterings and keeps the best
+    Args:
+        points: NumPy array, shape (n, 2), one [lon, lat] row per event
+        k: int, number of clusters
+        restarts: int, number of independent clusterings
+        max_iterations, tolerance: as for kmeans()
+        seed: int or None; the same seed always gives the same result,
+            whatever the number of workers
+        workers: int, number of processes (default: one per CPU); 1 runs
+            the clusterings in this process
+    Returns:
+        tuple (labels, centroids, inertia) of the clustering with the lowest
+            inertia (sum of squared distances of events to their centroids)
+    """
+    seeds = np.random.SeedSequence(seed).spawn(restarts)
+    tasks = [(child, k, max_iterations, tolerance) for child in seeds]
+    if workers == 1 or restarts == 1:
+        _init_restart(points)
+        results = [_restart(task) for task in tasks]
+    else:
+        with multiprocessing.Pool(workers, _init_restart, (points,)) as pool:
+            results = pool.map(_restart, tasks)
+    inertia, centroids, iterations = min(results, key=lambda result: result[0])
+    labels, sq_dists = assign(points, centroids)
+    return labels, centroids, float(sq_dists.sum())
+
+
+def minibatch_kmeans(chunk_source, k, batch_size, passes=1, seed=None):
+    """
+    mini-batch k-means over a stream of events
+    Args:
+        chunk_source: function of no arguments returning a fresh iterable of
+            NumPy arrays of shape (n, 2), one [lon, lat] row per event; it is
+            called once per pass
+        k: int, number of clusters
+        batch_size: int, number of events per centroid update
+        passes: int, number of passes over the stream
+        seed: int or None, seed for the k-means++ choice of starting
+            centroids among the first chunk's events
+    Returns:
+        tuple (centroids, counts): the (k, 2) centroid array and the number
+            of events that contributed to each centroid over all passes
+    """
+    centroids = None
+    counts = np.zeros(k)
+    for run in range(passes):
+        for chunk in chunk_source():
+            if centroids is None:
+                rng = np.random.default_rng(seed)
+                centroids = chunk[kmeans_plus_plus(chunk, k, rng)].astype(np.float64)
+            for start in range(0, len(chunk), batch_size):
+                minibatch_update(centroids, counts, chunk[start:start + batch_size])
+    if centroids is None:
+        raise ValueError("no events to cluster")
+    return centroids, counts
+
+
+def minibatch_update(centroids, counts, batch):
+    """
+    one mini-batch k-means step: moves each centroid toward the mean of the
+        batch events nearest to it
+    Args:
+        centroids: NumPy float array, shape (k, 2), updated in place
+        counts: NumPy float array, shape (k,), number of events each
+            centroid has absorbed so far; updated in place
+        batch: NumPy array, shape (n, 2), one [lon, lat] row per event
+    Returns:
+        NumPy int array, the cluster of each batch event (its nearest
+            centroid before the update, or the cluster re-seeded at it)
+    """
+    k = len(centroids)
+    labels, sq_dists = assign(batch, centroids)
+    # a cluster that has never won an event (e.g. seeded on the same
+    # location as another, which then wins every tie) would stay empty:
+    # restart it at the worst-served batch event, as kmeans() does
+    for cluster in np.flatnonzero(counts == 0):
+        if cluster in labels or len(batch) == 0:
+            continue
+        farthest = sq_dists.argmax()
+        if sq_dists[farthest] == 0.0:
+            break       # every batch event sits on a centroid already
+        centroids[cluster] = batch[farthest]
+        labels[farthest] = cluster
+        sq_dists[farthest] = 0.0
+    batch_counts = np.bincount(labels, minlength=k)
+    batch_sums = np.column_stack(
+        [np.bincount(labels, weights=batch[:, dim], minlength=k)
+         for dim in range(batch.shape[1])])
+    counts += batch_counts
+    seen = batch_counts > 0
+    # per-event learning rate 1/count, applied to the whole batch
+    centroids[seen] += ((batch_sums[seen]
+                         - batch_counts[seen, np.newaxis] * centroids[seen])
+                        / counts[seen, np.newaxis])
+    return labels
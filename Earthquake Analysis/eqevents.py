@@ -0,0 +1,152 @@
+"""
+eqevents.py: columnar storage of earthquake events
+Authors: Christopher Johnson
+
+read_file() in eqanalysis.py stores every event as a list of four Python
+floats in a dict, which takes a few hundred bytes per event and can only be
+processed with Python loops. read_events() parses the same USGS CSV files
+into an EventTable, which keeps each quantity in one contiguous NumPy float
+array (8 bytes per value) ready for vectorized analysis.
+
+An EventTable can also be used anywhere the dict from read_file() is used:
+it maps the record numbers 1, 2, ... to [lon, lat, mag, depth, time] lists.
+
+CSV columns (the location is quoted and contains commas):
+    0 event id, 1 magnitude, 2 epoch time, 3 UTC time, 4 local time,
+    5 location, 6 latitude, 7 longitude, 8 depth (km), 9 depth (miles)
+"""
+
+import csv
+import itertools
+from array import array
+from collections.abc import Mapping
+
+import numpy as np
+
+# column numbers in the USGS CSV files
+EVID_COLUMN = 0
+MAG_COLUMN = 1
+LAT_COLUMN = 6
+LON_COLUMN = 7
+DEPTH_COLUMN = 9    # miles
+TIME_COLUMN = 2     # seconds since 1970-01-01 UTC
+
+
+class EventTable(Mapping):
+    """
+    earthquake events stored column by column
+    Public data attributes:
+        lon, lat, mag, depth, time: NumPy float arrays, one entry per event;
+            depth is in miles, time in seconds since 1970-01-01 UTC
+    Mapping interface:
+        table[key] == [lon, lat, mag, depth, time] of event number key, where
+        keys run from 1 to len(table) like the dict read_file() returns
+    """
+
+    def __init__(self, lon, lat, mag, depth, time):
+        self.lon = lon
+        self.lat = lat
+        self.mag = mag
+        self.depth = depth
+        self.time = time
+
+    def __len__(self):
+        return len(self.lon)
+
+    def __iter__(self):
+        return iter(range(1, len(self.lon) + 1))
+
+    def __contains__(self, key):
+        return isinstance(key, int) and 1 <= key <= len(self.lon)
+
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        index = key - 1
+        return [float(self.lon[index]), float(self.lat[index]),
+                float(self.mag[index]), float(self.depth[index]),
+                float(self.time[index])]
+
+    def points(self):
+        """
+        the event locations as one array
+        Returns:
+            NumPy array of shape (len(self), 2); row i is [lon, lat] of
+            event number i+1
+        """
+        return np.column_stack((self.lon, self.lat))
+
+    def take(self, positions):
+        """
+        a table of some of the events
+        Args:
+            positions: NumPy int array (or boolean mask) of positions in the
+                columns, i.e. event numbers - 1
+        Returns:
+            EventTable of the chosen events, numbered from 1 again
+        """
+        return EventTable(self.lon[positions], self.lat[positions],
+                          self.mag[positions], self.depth[positions],
+                          self.time[positions])
+
+
+def read_events(filename):
+    """
+    read the EQ events from the csv file, 'filename', into an EventTable;
+        lines starting with # are skipped, and the quoted location column is
+        parsed as one field
+    Args:
+        filename: string, name of a CSV file containing the EQ data
+    Returns:
+        EventTable with the longitude, latitude, magnitude, depth (in
+            miles) and time of every event, in file order
+    """
+    with open(filename, "r", newline="") as fd:
+        return parse_events(_csv_rows(fd))
+
+
+def iter_event_chunks(filename, chunk_size):
+    """
+    read the EQ events from the csv file, 'filename', a chunk at a time, so
+        that files larger than memory can be processed
+    Args:
+        filename: string, name of a CSV file containing the EQ data
+        chunk_size: int, number of events per chunk
+    Returns:
+        generator of EventTables of up to 'chunk_size' events each, in file
+            order; only one chunk is held in memory at a time
+    """
+    with open(filename, "r", newline="") as fd:
+        rows = _csv_rows(fd)
+        while True:
+            chunk = parse_events(itertools.islice(rows, chunk_size))
+            if len(chunk) == 0:
+                return
+            yield chunk
+
+
+def _csv_rows(fd):
+    """the fields of each event record (non-comment line) of an open file"""
+    return csv.reader(line for line in fd if line[0] != '#')
+
+
+def parse_events(rows):
+    """
+    converts already split CSV records (e.g. lines read by eqingest.py) into
+        an EventTable
+    Args:
+        rows: iterable of CSV records, each a list of field strings
+    Returns:
+        EventTable of the events of the records, in order
+    """
+    columns = [array('d') for i in range(5)]
+    lon, lat, mag, depth, time = columns
+    for values in rows:
+        lon.append(float(values[LON_COLUMN]))
+        lat.append(float(values[LAT_COLUMN]))
+        mag.append(float(values[MAG_COLUMN]))
+        depth.append(float(values[DEPTH_COLUMN]))
+        time.append(float(values[TIME_COLUMN]))
+    # frombuffer shares the array's memory instead of copying it
+    return EventTable(*(np.frombuffer(column, dtype=np.float64)
+                        for column in columns))
@@ -0,0 +1,259 @@
+"""
+eqindex.py: grid index for geographic queries over earthquake events
+Authors: Christopher Johnson
+
+Answering "which events are near this point / inside this box" by looking
+at every event costs a full scan per question. GridIndex divides the
+lon/lat extent of the events into square cells of about POINTS_PER_CELL
+events each and sorts the events by cell, so the events of one row of
+cells are a contiguous slice. A query then only examines the events of the
+cells overlapping its bounding box.
+
+Distances are either planar, in degrees of lon/lat (as euclid_distance()
+in eqanalysis.py computes them), or great-circle distances in miles.
+Longitudes are not wrapped at +-180 degrees.
+
+Usage:
+
+python3 eqindex.py eq_file.csv --near LON LAT --within DISTANCE [--great-circle]
+python3 eqindex.py eq_file.csv --near LON LAT --nearest K [--great-circle]
+python3 eqindex.py eq_file.csv --box LON_MIN LAT_MIN LON_MAX LAT_MAX
+
+The same cells speed up the assignment step of k-means: for each cell,
+the centroids that could be nearest to some point of the cell are found
+from the cell's rectangle alone, and when that is a single centroid all
+the cell's events are assigned to it without computing their distances
+to every centroid.
+"""
+
+import argparse
+import sys
+
+import numpy as np
+
+from eqcluster import assign as assign_all
+from eqevents import read_events
+
+POINTS_PER_CELL = 16
+TIE_SLACK = 1e-9            # relative margin before a cell is decided whole
+EARTH_RADIUS_MILES = 3958.8
+
+
+def great_circle_miles(lon1, lat1, lon2, lat2):
+    """
+    great-circle (haversine) distance in miles; arguments in degrees and
+        may be NumPy arrays
+    """
+    lon1, lat1, lon2, lat2 = (np.radians(angle) for angle in (lon1, lat1, lon2, lat2))
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class GridIndex:
+    """
+    uniform grid over event locations
+    Public data attributes:
+        lon, lat: NumPy arrays of the indexed locations; query results are
+            positions in these arrays (event number - 1 for an EventTable)
+        cell_size: float, side of a cell in degrees
+    """
+
+    def __init__(self, lon, lat, cell_size=None):
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.lat = np.asarray(lat, dtype=np.float64)
+        count = len(self.lon)
+        if count:
+            self.lon0, self.lat0 = self.lon.min(), self.lat.min()
+            width = self.lon.max() - self.lon0
+            height = self.lat.max() - self.lat0
+        else:
+            self.lon0 = self.lat0 = width = height = 0.0
+        if cell_size is None:
+            area = max(width, 1e-6) * max(height, 1e-6)
+            cell_size = np.sqrt(area * POINTS_PER_CELL / max(count, 1))
+        self.cell_size = float(cell_size)
+        self.nx = int(width // self.cell_size) + 1
+        self.ny = int(height // self.cell_size) + 1
+
+        cells = self._cell_y(self.lat) * self.nx + self._cell_x(self.lon)
+        self.order = np.argsort(cells, kind="stable")
+        self.starts = np.searchsorted(cells[self.order], np.arange(self.nx * self.ny + 1))
+
+    @classmethod
+    def from_events(cls, table, cell_size=None):
+        """index over the events of an EventTable (see eqevents.py)"""
+        return cls(table.lon, table.lat, cell_size)
+
+    def _cell_x(self, lon):
+        return np.clip(((np.asarray(lon) - self.lon0) // self.cell_size).astype(np.int64),
+                       0, self.nx - 1)
+
+    def _cell_y(self, lat):
+        return np.clip(((np.asarray(lat) - self.lat0) // self.cell_size).astype(np.int64),
+                       0, self.ny - 1)
+
+    def _candidates(self, lon_min, lat_min, lon_max, lat_max):
+        """positions of the events in cells overlapping a rectangle"""
+        if len(self.lon) == 0 or lon_max < lon_min or lat_max < lat_min:
+            return np.empty(0, dtype=np.intp)
+        x0, x1 = self._cell_x(lon_min), self._cell_x(lon_max)
+        y0, y1 = self._cell_y(lat_min), self._cell_y(lat_max)
+        rows = [self.order[self.starts[y * self.nx + x0]:self.starts[y * self.nx + x1 + 1]]
+                for y in range(int(y0), int(y1) + 1)]
+        return np.concatenate(rows)
+
+    def bbox(self, lon_min, lat_min, lon_max, lat_max):
+        """
+        events inside a box
+        Returns:
+            NumPy array of the positions of events with lon_min <= lon <= lon_max
+                and lat_min <= lat <= lat_max, in increasing order
+        """
+        found = self._candidates(lon_min, lat_min, lon_max, lat_max)
+        lon, lat = self.lon[found], self.lat[found]
+        inside = (lon >= lon_min) & (lon <= lon_max) & (lat >= lat_min) & (lat <= lat_max)
+        return np.sort(found[inside])
+
+    def radius(self, lon, lat, radius, great_circle=False):
+        """
+        events within 'radius' of (lon, lat)
+        Args:
+            lon, lat: floats, centre of the search in degrees
+            radius: float, in degrees, or in miles if great_circle is True
+            great_circle: bool, measure great-circle distance in miles
+        Returns:
+            tuple (positions, distances) of NumPy arrays, nearest first
+        """
+        if great_circle:
+            dlat = np.degrees(radius / EARTH_RADIUS_MILES)
+            widest = min(abs(lat) + dlat, 90.0)
+            cos_lat = np.cos(np.radians(widest))
+            dlon = 360.0 if cos_lat < 1e-9 else min(dlat / cos_lat, 360.0)
+        else:
+            dlat = dlon = radius
+        found = self._candidates(lon - dlon, lat - dlat, lon + dlon, lat + dlat)
+        dists = self._distances(found, lon, lat, great_circle)
+        keep = dists <= radius
+        found, dists = found[keep], dists[keep]
+        by_distance = np.argsort(dists, kind="stable")
+        return found[by_distance], dists[by_distance]
+
+    def nearest(self, lon, lat, k, great_circle=False):
+        """
+        the 'k' events closest to (lon, lat)
+        Args:
+            lon, lat, great_circle: as for radius()
+            k: int, number of events wanted
+        Returns:
+            tuple (positions, distances) of NumPy arrays of up to k events,
+                nearest first
+        """
+        k = min(k, len(self.lon))
+        if k <= 0:
+            return np.empty(0, dtype=np.intp), np.empty(0)
+        search = self.cell_size * (69.0 if great_circle else 1.0)
+        while True:
+            found, dists = self.radius(lon, lat, search, great_circle)
+            if len(found) >= k:
+                return found[:k], dists[:k]
+            # widen the search until it holds k events; everything is
+            # reached once the radius spans the whole extent (or globe)
+            search *= 2.0
+
+    def _distances(self, positions, lon, lat, great_circle):
+        if great_circle:
+            return great_circle_miles(lon, lat, self.lon[positions], self.lat[positions])
+        return np.hypot(self.lon[positions] - lon, self.lat[positions] - lat)
+
+    def assign(self, centroids):
+        """
+        assigns each indexed event to its nearest centroid (planar distance),
+            like eqcluster.assign() but deciding whole cells at once when
+            only one centroid can be nearest to any point in them; the
+            labels, ties included, are the same as eqcluster.assign()'s
+        Args:
+            centroids: NumPy array, shape (k, 2), [lon, lat] rows
+        Returns:
+            tuple (labels, sq_dists) as for eqcluster.assign(), in the order
+                of the indexed events
+        """
+        count = len(self.lon)
+        counts = np.diff(self.starts)
+        occupied = np.flatnonzero(counts)
+        cx, cy = occupied % self.nx, occupied // self.nx
+        left = self.lon0 + cx * self.cell_size
+        bottom = self.lat0 + cy * self.cell_size
+        clon = centroids[:, 0][np.newaxis, :]
+        clat = centroids[:, 1][np.newaxis, :]
+        left, bottom = left[:, np.newaxis], bottom[:, np.newaxis]
+        right, top = left + self.cell_size, bottom + self.cell_size
+        # nearest and farthest possible squared distances from each cell to
+        # each centroid; a centroid can only win somewhere in the cell if its
+        # nearest distance beats every centroid's farthest distance. The
+        # slack keeps ties and near ties (within rounding) undecided, so
+        # they go to eqcluster.assign() and break the same way
+        near = (np.maximum(np.maximum(left - clon, clon - right), 0.0) ** 2
+                + np.maximum(np.maximum(bottom - clat, clat - top), 0.0) ** 2)
+        far = (np.maximum(np.abs(clon - left), np.abs(clon - right)) ** 2
+               + np.maximum(np.abs(clat - bottom), np.abs(clat - top)) ** 2)
+        possible = near <= far.min(axis=1)[:, np.newaxis] * (1.0 + TIE_SLACK)
+        decided = possible.sum(axis=1) == 1
+
+        labels = np.empty(count, dtype=np.intp)
+        cell_labels = np.where(decided, possible.argmax(axis=1), -1)
+        labels[self.order] = np.repeat(cell_labels, counts[occupied])
+        open_points = np.flatnonzero(labels < 0)
+        if len(open_points):
+            points = np.column_stack((self.lon[open_points], self.lat[open_points]))
+            labels[open_points] = assign_all(points, centroids)[0]
+        dlon = self.lon - centroids[:, 0][labels]
+        dlat = self.lat - centroids[:, 1][labels]
+        return labels, dlon * dlon + dlat * dlat
+
+
+def main():
+    """
+    Interaction if run from the command line: prints the events found, one
+        per line, with their distance when searching around a point
+    """
+    parser = argparse.ArgumentParser(description="Find earthquake events by location")
+    parser.add_argument('eq_file', type=str,
+                 help='A csv file containing earthquake events, one per line.')
+    parser.add_argument('--near', type=float, nargs=2, metavar=('LON', 'LAT'),
+                 help='Search around this point')
+    parser.add_argument('--within', type=float, metavar='DISTANCE',
+                 help='With --near: list events within DISTANCE of the point')
+    parser.add_argument('--nearest', type=int, metavar='K',
+                 help='With --near: list the K events nearest to the point')
+    parser.add_argument('--great-circle', action='store_true',
+                 help='Measure distances along the earth\'s surface in miles '
+                      'instead of in degrees')
+    parser.add_argument('--box', type=float, nargs=4,
+                 metavar=('LON_MIN', 'LAT_MIN', 'LON_MAX', 'LAT_MAX'),
+                 help='List the events inside this box')
+    args = parser.parse_args()
+    if (args.box is None) == (args.near is None) or \
+       (args.near is not None and (args.within is None) == (args.nearest is None)):
+        print('Give either --box, or --near with one of --within and --nearest')
+        sys.exit(1)
+    events = read_events(args.eq_file)
+    index = GridIndex.from_events(events)
+    if args.box is not None:
+        found, dists = index.bbox(*args.box), None
+    elif args.within is not None:
+        found, dists = index.radius(args.near[0], args.near[1], args.within,
+                                    args.great_circle)
+    else:
+        found, dists = index.nearest(args.near[0], args.near[1], args.nearest,
+                                     args.great_circle)
+    for rank, position in enumerate(found):
+        lon, lat, mag, depth = events[int(position) + 1][:4]
+        line = "Event {}: lon {:.4f} lat {:.4f} magnitude {:.1f} depth {:.1f} miles".format(
+            position + 1, lon, lat, mag, depth)
+        if dists is not None:
+            line += ", distance {:.4f}".format(dists[rank])
+        print(line)
+
+if __name__ == "__main__":
+    main()
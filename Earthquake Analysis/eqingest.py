@@ -0,0 +1,285 @@
+"""
+eqingest.py: incremental ingest of a growing earthquake catalog
+Authors: Christopher Johnson
+
+Re-running eqanalysis.py on a catalog that only ever has events appended
+re-parses the whole file every time. ingest() instead remembers, in a
+state file next to the catalog (catalog + STATE_SUFFIX, JSON):
+
+    the byte offset up to which the file has been read, and a digest of
+        the bytes just before it, to notice a file that was rewritten
+        rather than appended to (it is then ingested from scratch)
+    the event ids (CSV column 0) seen so far, so that repeated records
+        are counted once
+    DataAccumulators (with quantile sketches) of the magnitudes and depths,
+        counting values to STATS_RESOLUTION so that their frequency tables
+        do not grow with the catalog
+    the cluster centroids and the number of events each has absorbed, or,
+    until the events seen cover k distinct locations, the ids and
+    locations of those events
+
+Each run parses only the complete lines after the offset, drops records
+whose id has been seen, adds the rest to the accumulators, and clusters
+them: the first batch with k-means, later ones with mini-batch k-means
+updates of the saved centroids (see eqcluster.py). Clustering waits until
+there are k distinct locations to start from, so that no two clusters
+start on the same spot. The cluster of every event is appended to catalog + ASSIGNMENT_SUFFIX as "id,cluster"
+lines; assignments already written are not revised when centroids move.
+
+Usage:
+
+python3 eqingest.py eq_file.csv [--reset] [--clusters K] [--seed N]
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import math
+import os
+import sys
+
+import numpy as np
+
+from data import DataAccumulator, QuantileSketch
+from eqevents import EVID_COLUMN, parse_events
+from eqcluster import kmeans, kmeans_plus_plus, minibatch_update
+
+STATE_SUFFIX = ".ingest"
+ASSIGNMENT_SUFFIX = ".clusters"
+STATE_VERSION = 3
+CHUNK_BYTES = 4 << 20       # bytes of the catalog read at a time
+CHECK_BYTES = 1 << 16       # bytes before the offset covered by the digest
+NO_OF_CLUSTERS = 6          # as in eqanalysis.py
+NO_OF_ITERATIONS = 100      # k-means iterations for the first batch
+STATS_RESOLUTION = 0.1      # rounding of the counted values, as the catalog
+                            # gives them, so the frequency tables stay bounded
+
+
+def tail_digest(filename, offset):
+    """
+    SHA-1 digest (hex) of the CHECK_BYTES bytes of a file before 'offset'
+    """
+    start = max(0, offset - CHECK_BYTES)
+    with open(filename, "rb") as fd:
+        fd.seek(start)
+        return hashlib.sha1(fd.read(offset - start)).hexdigest()
+
+
+def new_state(k):
+    """ingest state of a catalog nothing has been read from"""
+    return {"offset": 0, "digest": hashlib.sha1(b"").hexdigest(),
+            "ids": set(), "assignments_size": 0,
+            "mag_stats": DataAccumulator(STATS_RESOLUTION, QuantileSketch()),
+            "depth_stats": DataAccumulator(STATS_RESOLUTION, QuantileSketch()),
+            "centroids": None, "counts": np.zeros(k), "pending": [ ]}
+
+
+def load_state(state_path):
+    """
+    Returns:
+        the ingest state saved at state_path, or None if there is none (or
+            it was written by an incompatible version)
+    """
+    try:
+        with open(state_path, "r") as fd:
+            fields = json.load(fd)
+    except (OSError, ValueError):
+        return None
+    if fields.get("version") != STATE_VERSION:
+        return None
+    return {"offset": fields["offset"], "digest": fields["digest"],
+            "ids": set(fields["ids"]),
+            "assignments_size": fields["assignments_size"],
+            "mag_stats": DataAccumulator.from_json(fields["mag_stats"]),
+            "depth_stats": DataAccumulator.from_json(fields["depth_stats"]),
+            "centroids": (None if fields["centroids"] is None
+                          else np.array(fields["centroids"], dtype=np.float64)),
+            "counts": np.array(fields["counts"], dtype=np.float64),
+            "pending": fields["pending"]}
+
+
+def save_state(state_path, state):
+    """
+    writes the ingest state to a temporary file and renames it over
+        state_path, so an interrupted run leaves the previous state intact
+    """
+    fields = {"version": STATE_VERSION, "offset": state["offset"],
+              "digest": state["digest"], "ids": sorted(state["ids"]),
+              "assignments_size": state["assignments_size"],
+              "mag_stats": state["mag_stats"].to_json(),
+              "depth_stats": state["depth_stats"].to_json(),
+              "centroids": (None if state["centroids"] is None
+                            else state["centroids"].tolist()),
+              "counts": state["counts"].tolist(),
+              "pending": state["pending"]}
+    temp_path = "{}.{}.tmp".format(state_path, os.getpid())
+    with open(temp_path, "w") as fd:
+        json.dump(fields, fd)
+    os.replace(temp_path, state_path)
+
+
+def new_records(filename, offset, chunk_bytes=CHUNK_BYTES):
+    """
+    the event records after a byte offset of a catalog, a chunk at a time;
+        a last line without its newline is left for a later run
+    Args:
+        filename: string, name of the CSV catalog
+        offset: int, byte offset to start at (the start of a line)
+        chunk_bytes: int, bytes read at a time
+    Returns:
+        generator of (records, end) pairs: records is a list of CSV records
+            (lists of fields), end the byte offset just after them
+    """
+    with open(filename, "rb") as fd:
+        fd.seek(offset)
+        pending = b""
+        while True:
+            block = fd.read(chunk_bytes)
+            if not block:
+                return
+            block = pending + block
+            cut = block.rfind(b"\n") + 1
+            pending = block[cut:]
+            if cut == 0:
+                continue
+            offset += cut
+            lines = block[:cut].decode("utf-8").splitlines()
+            yield list(csv.reader(line for line in lines if line and line[0] != '#')), offset
+
+
+def ingest(filename, k=NO_OF_CLUSTERS, seed=None, reset=False):
+    """
+    brings the saved statistics and cluster assignments of a catalog up to
+        date with the events appended to it since the last run
+    Args:
+        filename: string, name of the CSV catalog
+        k: int, number of clusters (must match the saved state)
+        seed: int or None, seed for the first batch's k-means++ centroids
+        reset: bool, ignore the saved state and ingest the whole file again
+    Returns:
+        tuple (state, added, duplicates): the updated state (see new_state),
+            the number of new events and the number of repeated records
+            skipped in this run
+    """
+    state_path = filename + STATE_SUFFIX
+    assignment_path = filename + ASSIGNMENT_SUFFIX
+    state = None if reset else load_state(state_path)
+    if state is not None and len(state["counts"]) != k:
+        raise ValueError("{} holds {} clusters, not {}; use --reset to start over"
+                         .format(state_path, len(state["counts"]), k))
+    if state is not None and (os.path.getsize(filename) < state["offset"]
+                              or tail_digest(filename, state["offset"]) != state["digest"]):
+        print("{} has changed, not only grown; ingesting it again".format(filename))
+        state = None
+    if state is None:
+        state = new_state(k)
+    ids = state["ids"]
+    added = duplicates = 0
+
+    with open(assignment_path, "a+") as out:
+        # drop assignments written by a run that did not get to save its state
+        out.truncate(state["assignments_size"])
+        out.seek(state["assignments_size"])
+        for records, end in new_records(filename, state["offset"]):
+            kept = []
+            kept_ids = []
+            for values in records:
+                evid = values[EVID_COLUMN]
+                if evid in ids:
+                    duplicates += 1
+                    continue
+                ids.add(evid)
+                kept.append(values)
+                kept_ids.append(evid)
+            state["offset"] = end
+            if not kept:
+                continue
+            table = parse_events(kept)
+            state["mag_stats"].update(map(float, table.mag))
+            state["depth_stats"].update(map(float, table.depth))
+            points = table.points()
+            if state["centroids"] is None:
+                # hold the events back until k-means++ can start every
+                # cluster on a location of its own
+                pending = state["pending"]
+                pending.extend([evid, lon, lat] for evid, (lon, lat)
+                               in zip(kept_ids, points.tolist()))
+                points = np.array([place[1:] for place in pending], dtype=np.float64)
+                if len(np.unique(points, axis=0)) < k:
+                    added += len(kept)
+                    continue
+                kept_ids = [place[0] for place in pending]
+                state["pending"] = [ ]
+                rng = np.random.default_rng(seed)
+                start = points[kmeans_plus_plus(points, k, rng)]
+                labels, centroids, iterations, inertia = kmeans(points, start,
+                                                                NO_OF_ITERATIONS)
+                state["centroids"] = centroids
+                state["counts"] = np.bincount(labels, minlength=k).astype(np.float64)
+            else:
+                labels = minibatch_update(state["centroids"], state["counts"], points)
+            out.writelines("{},{}\n".format(evid, label)
+                           for evid, label in zip(kept_ids, labels.tolist()))
+            added += len(kept)
+        out.flush()
+        state["assignments_size"] = out.tell()
+    state["digest"] = tail_digest(filename, state["offset"])
+    save_state(state_path, state)
+    return state, added, duplicates
+
+
+def print_summary(state):
+    """
+    prints the statistics and clusters of everything ingested so far
+    """
+    for (name, stats, unit) in (("magnitude", state["mag_stats"], ""),
+                                ("depth", state["depth_stats"], " miles")):
+        if stats.count == 0:
+            continue
+        (p50, p90, p99) = stats.sketch.quantiles([0.5, 0.9, 0.99])
+        standdev = math.sqrt(stats.variance()) if stats.count > 1 else 0.0
+        print("Mean {} = {:.1f}{}".format(name, stats.mean, unit))
+        print("Median {} = {:.1f}{}".format(name, stats.median(), unit))
+        print("Standard deviation = {:.2f}{}".format(standdev, unit))
+        print("Percentiles p50 / p90 / p99 = {:.1f} / {:.1f} / {:.1f}{}".format(
+            p50, p90, p99, unit))
+    if state["centroids"] is None:
+        print("{} events waiting for {} distinct locations to start clustering".format(
+            len(state["pending"]), len(state["counts"])))
+    else:
+        for ct in range(len(state["centroids"])):
+            print("Cluster {}: {:.0f} events, centroid lon {:.4f} lat {:.4f}".format(
+                ct, state["counts"][ct], state["centroids"][ct][0],
+                state["centroids"][ct][1]))
+
+
+def main():
+    """
+    Interaction if run from the command line.
+    Usage:  python3 eqingest.py eq_data_file.csv
+    """
+    parser = argparse.ArgumentParser(
+        description="Update earthquake statistics with the events appended to a file")
+    parser.add_argument('eq_file', type=str,
+                 help='A csv file containing earthquake events, one per line.')
+    parser.add_argument('--clusters', type=int, default=NO_OF_CLUSTERS,
+                 help='Number of clusters (default {})'.format(NO_OF_CLUSTERS))
+    parser.add_argument('--seed', type=int, default=None,
+                 help='Random seed for choosing the starting cluster centroids')
+    parser.add_argument('--reset', action='store_true',
+                 help='Forget what was ingested before and read the whole file')
+    args = parser.parse_args()
+    try:
+        state, added, duplicates = ingest(args.eq_file, args.clusters, args.seed,
+                                          args.reset)
+    except ValueError as error:
+        print(error)
+        sys.exit(1)
+    print("{} new events, {} repeated records skipped, {} events in total".format(
+        added, duplicates, len(state["ids"])))
+    print_summary(state)
+    print("Cluster assignments in {}".format(args.eq_file + ASSIGNMENT_SUFFIX))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+"""
+eqrender.py: headless raster drawing of earthquake events
+Authors: Christopher Johnson
+
+The plot_* functions in eqanalysis.py draw one turtle dot per event, which
+needs a Tk window and takes minutes for large files. The functions here
+draw onto a NumPy image instead: the basemap GIF is decoded into an array
+(read_gif), all dots of one size and color are stamped in a single
+vectorized assignment (draw_dots), and the result is saved as PNG or PPM
+(write_image), without Tk or any imaging library.
+
+Colors are the Tk color names the turtle plots use; COLOR_RGB gives their
+values.
+"""
+
+import struct
+import zlib
+
+import numpy as np
+
+# RGB values of the Tk colors used by the plots
+COLOR_RGB = {
+    "violet": (238, 130, 238),
+    "purple": (160, 32, 240),
+    "DarkBlue": (0, 0, 139),
+    "dark blue": (0, 0, 139),
+    "blue": (0, 0, 255),
+    "powder blue": (176, 224, 230),
+    "light green": (144, 238, 144),
+    "green yellow": (173, 255, 47),
+    "green": (0, 255, 0),
+    "dark green": (0, 100, 0),
+    "yellow": (255, 255, 0),
+    "orange": (255, 165, 0),
+    "dark orange": (255, 140, 0),
+    "red": (255, 0, 0),
+}
+
+DEFAULT_DOT_SIZE = 5        # turtle.dot() diameter when no size is given
+PIXELS_PER_BATCH = 1 << 22  # bounds the index arrays built by draw_dots
+DILATE_FACTOR = 32          # draw_dots switches to mask dilation above
+                            # (image pixels / DILATE_FACTOR) dots
+
+
+def read_gif(filename):
+    """
+    decodes the first image of a GIF file
+    Args:
+        filename: string, name of a GIF87a or GIF89a file
+    Returns:
+        NumPy uint8 array of shape (height, width, 3), RGB pixels; areas of
+            the screen the image does not cover have the background color
+    """
+    with open(filename, "rb") as fd:
+        data = fd.read()
+    if data[:6] not in (b"GIF87a", b"GIF89a"):
+        raise ValueError("{} is not a GIF file".format(filename))
+    width, height, flags, background = struct.unpack_from("<HHBB", data, 6)
+    pos = 13
+    palette = None
+    if flags & 0x80:
+        palette, pos = _read_palette(data, pos, flags)
+    while pos < len(data):
+        block = data[pos]
+        pos += 1
+        if block == 0x21:
+            # extension (comment, graphic control, ...): label + sub-blocks
+            pos = _skip_sub_blocks(data, pos + 1)
+        elif block == 0x2C:
+            left, top, part_width, part_height, part_flags = struct.unpack_from(
+                "<HHHHB", data, pos)
+            pos += 9
+            if part_flags & 0x80:
+                palette, pos = _read_palette(data, pos, part_flags)
+            if palette is None:
+                raise ValueError("{} has no color table".format(filename))
+            min_code_size = data[pos]
+            pos += 1
+            chunks = []
+            while data[pos]:
+                chunks.append(data[pos + 1:pos + 1 + data[pos]])
+                pos += 1 + data[pos]
+            indices = _lzw_decode(b"".join(chunks), min_code_size)
+            pixels = np.zeros(part_width * part_height, dtype=np.uint8)
+            count = min(len(indices), len(pixels))
+            pixels[:count] = np.frombuffer(bytes(indices[:count]), dtype=np.uint8)
+            pixels = pixels.reshape(part_height, part_width)
+            if part_flags & 0x40:
+                pixels = pixels[_interlaced_rows(part_height)]
+            image = np.empty((height, width, 3), dtype=np.uint8)
+            image[:, :] = palette[background] if background < len(palette) else 0
+            part = palette[np.minimum(pixels, len(palette) - 1)]
+            image[top:top + part_height, left:left + part_width] = \
+                part[:height - top, :width - left]
+            return image
+        else:
+            break
+    raise ValueError("{} has no image".format(filename))
+
+
+def _read_palette(data, pos, flags):
+    """(colors as an (n, 3) uint8 array, position after them)"""
+    size = 3 << ((flags & 7) + 1)
+    palette = np.frombuffer(data, dtype=np.uint8, count=size, offset=pos)
+    return palette.reshape(-1, 3), pos + size
+
+
+def _skip_sub_blocks(data, pos):
+    """position after a sequence of length-prefixed sub-blocks"""
+    while data[pos]:
+        pos += 1 + data[pos]
+    return pos + 1
+
+
+def _interlaced_rows(height):
+    """row permutation undoing GIF's four-pass interlacing"""
+    stored = [row for start, step in ((0, 8), (4, 8), (2, 4), (1, 2))
+              for row in range(start, height, step)]
+    order = np.empty(height, dtype=np.intp)
+    order[stored] = np.arange(height)
+    return order
+
+
+def _lzw_decode(data, min_code_size):
+    """
+    decompresses GIF image data (variable code width LZW, up to 12 bits)
+    Returns:
+        bytearray of color indices
+    """
+    clear = 1 << min_code_size
+    end = clear + 1
+    table = [bytes((index,)) for index in range(clear)] + [b"", b""]
+    code_size = min_code_size + 1
+    out = bytearray()
+    bits = 0
+    held = 0
+    prev = None
+    for byte in data:
+        bits |= byte << held
+        held += 8
+        while held >= code_size:
+            code = bits & ((1 << code_size) - 1)
+            bits >>= code_size
+            held -= code_size
+            if code == clear:
+                del table[clear + 2:]
+                code_size = min_code_size + 1
+                prev = None
+                continue
+            if code == end:
+                return out
+            if prev is None:
+                entry = table[code]
+            else:
+                entry = table[code] if code < len(table) else prev + prev[:1]
+                if len(table) < 4096:
+                    table.append(prev + entry[:1])
+            out += entry
+            prev = entry
+            if len(table) == 1 << code_size and code_size < 12:
+                code_size += 1
+    return out
+
+
+def write_png(filename, image):
+    """
+    writes an RGB image as an (unfiltered, zlib compressed) PNG file
+    Args:
+        filename: string, name of the file to write
+        image: NumPy uint8 array of shape (height, width, 3)
+    """
+    height, width = image.shape[:2]
+    rows = np.empty((height, 1 + width * 3), dtype=np.uint8)
+    rows[:, 0] = 0      # filter type "none" for every row
+    rows[:, 1:] = image.reshape(height, width * 3)
+
+    def chunk(kind, payload):
+        return (struct.pack(">I", len(payload)) + kind + payload
+                + struct.pack(">I", zlib.crc32(kind + payload) & 0xFFFFFFFF))
+
+    with open(filename, "wb") as fd:
+        fd.write(b"\x89PNG\r\n\x1a\n")
+        fd.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        fd.write(chunk(b"IDAT", zlib.compress(rows.tobytes(), 6)))
+        fd.write(chunk(b"IEND", b""))
+
+
+def write_ppm(filename, image):
+    """
+    writes an RGB image as a binary PPM (P6) file
+    Args:
+        filename: string, name of the file to write
+        image: NumPy uint8 array of shape (height, width, 3)
+    """
+    height, width = image.shape[:2]
+    with open(filename, "wb") as fd:
+        fd.write("P6\n{} {}\n255\n".format(width, height).encode("ascii"))
+        fd.write(np.ascontiguousarray(image, dtype=np.uint8).tobytes())
+
+
+def write_image(filename, image):
+    """
+    writes an RGB image as PPM if 'filename' ends in .ppm, otherwise as PNG
+    """
+    if filename.lower().endswith(".ppm"):
+        write_ppm(filename, image)
+    else:
+        write_png(filename, image)
+
+
+def _disc_offsets(diameter):
+    """(row, column) offsets of the pixels of a dot of the given diameter"""
+    radius = diameter / 2.0
+    reach = int(np.ceil(radius))
+    dy, dx = np.mgrid[-reach:reach + 1, -reach:reach + 1]
+    inside = dx * dx + dy * dy <= radius * radius
+    return dy[inside], dx[inside]
+
+
+def draw_dots(image, cols, rows, diameter, color):
+    """
+    draws filled dots of one size and color, like turtle.dot(), all at once
+    Args:
+        image: NumPy uint8 array of shape (height, width, 3), drawn on in place
+        cols, rows: NumPy arrays, pixel column and row of each dot's centre
+        diameter: int, dot diameter in pixels
+        color: Tk color name (see COLOR_RGB) or (r, g, b) tuple
+    """
+    height, width = image.shape[:2]
+    rgb = COLOR_RGB[color] if isinstance(color, str) else color
+    dy, dx = _disc_offsets(diameter)
+    cols = np.rint(cols).astype(np.intp)
+    rows = np.rint(rows).astype(np.intp)
+    if len(cols) * DILATE_FACTOR > height * width:
+        # many dots: mark the centres, then spread the marks by every disc
+        # offset in whole-image steps; the cost no longer grows with the
+        # number of dots
+        reach = int(max(np.abs(dy).max(), np.abs(dx).max()))
+        centres = np.zeros((height + 2 * reach, width + 2 * reach), dtype=bool)
+        rows, cols = rows + reach, cols + reach
+        inside = ((rows >= 0) & (rows < centres.shape[0])
+                  & (cols >= 0) & (cols < centres.shape[1]))
+        centres[rows[inside], cols[inside]] = True
+        covered = np.zeros((height, width), dtype=bool)
+        for oy, ox in zip(dy, dx):
+            covered |= centres[reach - oy:reach - oy + height, reach - ox:reach - ox + width]
+        image[covered] = rgb
+        return
+    batch = max(1, PIXELS_PER_BATCH // len(dy))
+    for start in range(0, len(cols), batch):
+        ys = (rows[start:start + batch, np.newaxis] + dy).ravel()
+        xs = (cols[start:start + batch, np.newaxis] + dx).ravel()
+        visible = (ys >= 0) & (ys < height) & (xs >= 0) & (xs < width)
+        image[ys[visible], xs[visible]] = rgb
+
+
+def shade_grid(image, pixel_rows, pixel_cols, cell_classes, colors, opacity):
+    """
+    tints the pixels of an image by the class of the grid cell under them
+    Args:
+        image: NumPy uint8 array of shape (height, width, 3), drawn on in place
+        pixel_rows, pixel_cols: NumPy int arrays of length height and width,
+            the grid row under each pixel row and grid column under each
+            pixel column
+        cell_classes: NumPy int array of the grid's shape, class of each
+            cell; cells with class -1 are left untinted
+        colors: list of Tk color names indexed by class
+        opacity: float between 0 and 1, how much of the cell color is mixed in
+    """
+    palette = np.array([COLOR_RGB[color] for color in colors], dtype=np.float64)
+    classes = cell_classes[pixel_rows[:, np.newaxis], pixel_cols[np.newaxis, :]]
+    tinted = classes >= 0
+    image[tinted] = np.rint(image[tinted] * (1.0 - opacity)
+                            + palette[classes[tinted]] * opacity).astype(np.uint8)
+
+
+def draw_classes(image, cols, rows, classes, sizes, colors):
+    """
+    draws one dot per event, its size and color chosen by its class, with
+        the largest dots drawn first so that small ones stay visible
+    Args:
+        image: NumPy uint8 array of shape (height, width, 3), drawn on in place
+        cols, rows: NumPy arrays, pixel position of each event
+        classes: NumPy int array, class (e.g. magnitude bin) of each event
+        sizes, colors: lists indexed by class; sizes may be None to draw
+            every dot at DEFAULT_DOT_SIZE
+    """
+    present = np.unique(classes)
+    if sizes is not None:
+        present = sorted(present, key=lambda cls: -sizes[cls])
+    for cls in present:
+        chosen = classes == cls
+        size = DEFAULT_DOT_SIZE if sizes is None else sizes[cls]
+        draw_dots(image, cols[chosen], rows[chosen], size, colors[cls])
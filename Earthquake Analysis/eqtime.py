@@ -0,0 +1,146 @@
+"""
+eqtime.py: time-range queries and rolling statistics over earthquake events
+Authors: Christopher Johnson
+
+Counting the events of a week, or their mean magnitude, by testing every
+event's time costs a pass over the whole catalog per question. TimeIndex
+sorts the events by time once and keeps prefix sums (running totals) of
+the magnitudes in that order. The events of any time range are then a
+contiguous slice found by two binary searches, and the count and
+magnitude sum of the range are differences of two prefix sums: each
+query takes O(log n) time however many events the range holds.
+
+Times are seconds since 1970-01-01 UTC, as in the CSV files' epoch column.
+"""
+
+import datetime
+
+import numpy as np
+
+SECONDS_PER_DAY = 86400.0
+
+
+def parse_time(text):
+    """
+    converts a command line time to seconds since 1970-01-01 UTC
+    Args:
+        text: string, either a number of seconds or a UTC date/time written
+            YYYY-MM-DD, YYYY-MM-DDTHH:MM or YYYY-MM-DDTHH:MM:SS
+    Returns:
+        float, seconds since 1970-01-01 UTC
+    """
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    for layout in ("%Y-%m-%d", "%Y-%m-%dT%H:%M", "%Y-%m-%dT%H:%M:%S"):
+        try:
+            moment = datetime.datetime.strptime(text, layout)
+        except ValueError:
+            continue
+        return moment.replace(tzinfo=datetime.timezone.utc).timestamp()
+    raise ValueError("cannot read the time {!r}; use YYYY-MM-DD or epoch seconds"
+                     .format(text))
+
+
+def format_time(seconds):
+    """
+    Args:
+        seconds: float, seconds since 1970-01-01 UTC
+    Returns:
+        string, the UTC date and time as YYYY/MM/DD HH:MM:SS
+    """
+    moment = datetime.datetime.fromtimestamp(seconds, datetime.timezone.utc)
+    return moment.strftime("%Y/%m/%d %H:%M:%S")
+
+
+class TimeIndex:
+    """
+    events sorted by time, with prefix sums of their magnitudes
+    Public data attributes:
+        order: NumPy int array, positions of the events (event number - 1
+            for an EventTable) from earliest to latest
+        times: NumPy float array, the event times in that order
+    """
+
+    def __init__(self, times, mags):
+        """
+        Args:
+            times: NumPy float array, time of each event
+            mags: NumPy float array, magnitude of each event
+        """
+        times = np.asarray(times, dtype=np.float64)
+        self.order = np.argsort(times, kind="stable")
+        self.times = times[self.order]
+        # mag_sums[i] is the sum of the magnitudes of the i earliest events
+        self.mag_sums = np.concatenate(([0.0], np.cumsum(np.asarray(mags)[self.order])))
+
+    @classmethod
+    def from_events(cls, table):
+        """index over the events of an EventTable (see eqevents.py)"""
+        return cls(table.time, table.mag)
+
+    def __len__(self):
+        return len(self.times)
+
+    def span(self, start, end):
+        """
+        Args:
+            start, end: times; the range includes start but not end
+        Returns:
+            tuple (lo, hi): the events of the range are order[lo:hi]
+        """
+        lo = np.searchsorted(self.times, start, side="left")
+        hi = np.searchsorted(self.times, end, side="left")
+        return int(lo), int(max(lo, hi))
+
+    def positions(self, start, end):
+        """
+        Returns:
+            NumPy int array, positions of the events with start <= time < end,
+                in time order
+        """
+        lo, hi = self.span(start, end)
+        return self.order[lo:hi]
+
+    def count(self, start, end):
+        """number of events with start <= time < end"""
+        lo, hi = self.span(start, end)
+        return hi - lo
+
+    def mean_magnitude(self, start, end):
+        """mean magnitude of the events with start <= time < end (nan if none)"""
+        lo, hi = self.span(start, end)
+        if hi == lo:
+            return float("nan")
+        return float((self.mag_sums[hi] - self.mag_sums[lo]) / (hi - lo))
+
+    def rolling(self, window, step=None, start=None, end=None):
+        """
+        statistics of a series of equal time windows, all found with one
+            vectorized binary search
+        Args:
+            window: float, length of each window in seconds
+            step: float, seconds between window starts (default: window, so
+                the windows do not overlap)
+            start, end: times covered (default: from the first event to the
+                last)
+        Returns:
+            tuple (starts, counts, mean_mags) of NumPy arrays, one entry per
+                window: its start time, number of events and mean magnitude
+                (nan for windows without events)
+        """
+        if step is None:
+            step = window
+        if start is None:
+            start = self.times[0] if len(self.times) else 0.0
+        if end is None:
+            end = self.times[-1] if len(self.times) else start
+        # every window start from 'start' up to and including 'end'
+        starts = start + step * np.arange(int((end - start) // step) + 1)
+        lo = np.searchsorted(self.times, starts, side="left")
+        hi = np.searchsorted(self.times, starts + window, side="left")
+        counts = hi - lo
+        sums = self.mag_sums[hi] - self.mag_sums[lo]
+        mean_mags = np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+        return starts, counts, mean_mags
@@ -0,0 +1,105 @@
+"""
+test_eqanalysis.py: command line runs of eqanalysis.py on narrow time ranges
+Authors: Christopher Johnson
+
+Run with:  python3 -m pytest test_eqanalysis.py   (or python3 -m unittest)
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+from eqanalysis import MAG_BOUNDS, bin_value, bin_values
+from eqcluster import kmeans_plus_plus
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+EQ_FILE = os.path.join(HERE, "10k.csv")
+EMPTY_RANGE = ["--since", "2099-01-01"]
+TWO_EVENTS = ["--since", "2015-07-01T21:00"]     # fewer events than clusters
+
+
+def run(*args):
+    """runs eqanalysis.py on 10k.csv; returns (exit status, output)"""
+    done = subprocess.run([sys.executable, os.path.join(HERE, "eqanalysis.py"), EQ_FILE]
+                          + list(args), cwd=HERE, capture_output=True, text=True,
+                          timeout=300)
+    return done.returncode, done.stdout + done.stderr
+
+
+class EmptyRangeTest(unittest.TestCase):
+
+    def check_empty(self, *args):
+        status, output = run(*(list(args) + EMPTY_RANGE))
+        self.assertEqual(status, 0, output)
+        self.assertIn("No events in the time range", output)
+        self.assertNotIn("Traceback", output)
+
+    def test_magnitudes(self):
+        self.check_empty("analyze", "magnitudes")
+
+    def test_depths(self):
+        self.check_empty("analyze", "depths")
+
+    def test_clusters(self):
+        self.check_empty("analyze", "clusters")
+
+    def test_render_clusters(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            self.check_empty("plot", "clusters", "--render",
+                             os.path.join(work_dir, "clusters.png"))
+
+    def test_timeline(self):
+        self.check_empty("analyze", "timeline")
+
+
+class FewEventsTest(unittest.TestCase):
+
+    def test_analyze_clusters(self):
+        status, output = run("analyze", "clusters", *TWO_EVENTS)
+        self.assertEqual(status, 0, output)
+        self.assertIn("Only 2 events; making 2 clusters", output)
+        self.assertIn("Analysis of cluster 1", output)
+        self.assertNotIn("Analysis of cluster 2", output)
+
+    def test_render_clusters(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            image = os.path.join(work_dir, "clusters.png")
+            status, output = run("plot", "clusters", "--render", image, *TWO_EVENTS)
+            self.assertEqual(status, 0, output)
+            self.assertTrue(os.path.getsize(image) > 0)
+
+    def test_timeline_until_is_exclusive(self):
+        status, output = run("analyze", "timeline", "--since", "2015-06-24",
+                             "--until", "2015-07-01")
+        self.assertEqual(status, 0, output)
+        # one 7 day window; none starting at 'until' itself
+        self.assertIn("2015/06/24 00:00:00", output)
+        self.assertNotIn("2015/07/01 00:00:00", output)
+
+
+class KMeansPlusPlusTest(unittest.TestCase):
+
+    def test_no_points(self):
+        with self.assertRaises(ValueError):
+            kmeans_plus_plus(np.empty((0, 2)), 3, np.random.default_rng(0))
+
+
+class BinTest(unittest.TestCase):
+
+    def test_nan_in_same_bin(self):
+        values = np.array([0.5, 1.0, float('nan'), 4.2, 9.5, float('nan')])
+        bins, counts = bin_values(values, MAG_BOUNDS)
+        self.assertEqual(bins.tolist(), [bin_value(value, MAG_BOUNDS)
+                                         for value in values.tolist()])
+        self.assertEqual(bins[2], len(MAG_BOUNDS) + 1)
+        # NaN is in no bin of the table
+        self.assertEqual(len(counts), len(MAG_BOUNDS) + 1)
+        self.assertEqual(counts.sum(), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+"""
+test_eqcluster.py: mini-batch k-means from starting centroids that coincide
+Authors: Christopher Johnson
+
+Run with:  python3 -m pytest test_eqcluster.py   (or python3 -m unittest)
+"""
+
+import unittest
+
+import numpy as np
+
+from eqcluster import minibatch_kmeans, minibatch_update
+
+
+def spread_points(count, seed):
+    rng = np.random.default_rng(seed)
+    return np.column_stack((rng.uniform(-125.0, -117.0, count),
+                            rng.uniform(42.0, 49.0, count)))
+
+
+class EmptyClusterTest(unittest.TestCase):
+
+    def test_duplicate_centroids_separate(self):
+        centroids = np.array([[-121.0, 45.0]] * 4)
+        counts = np.zeros(4)
+        labels = minibatch_update(centroids, counts, spread_points(200, 1))
+        self.assertTrue((counts > 0).all(), counts)
+        self.assertEqual(len(np.unique(centroids, axis=0)), 4)
+        self.assertEqual(sorted(set(labels.tolist())), [0, 1, 2, 3])
+
+    def test_absorbed_clusters_are_kept(self):
+        centroids = np.array([[-124.0, 43.0], [-118.0, 48.0]])
+        counts = np.array([10.0, 0.0])
+        before = centroids.copy()
+        # every event is nearest to centroid 0, and there is nowhere better
+        # to put centroid 1 than the farthest of them
+        minibatch_update(centroids, counts, np.array([[-124.0, 43.0]] * 5))
+        self.assertTrue((centroids == before).all())
+        self.assertEqual(counts.tolist(), [15.0, 0.0])
+
+    def test_small_first_chunk(self):
+        # the first chunk has one location, away from the other events, for
+        # six clusters; once one centroid leaves it for the events, the
+        # others never win any
+        first = np.array([[-130.0, 40.0]] * 3)
+        rest = spread_points(2000, 2)
+        centroids, counts = minibatch_kmeans(lambda: [first, rest], 6, 100, seed=0)
+        self.assertTrue((counts > 0).all(), counts)
+        self.assertEqual(len(np.unique(centroids, axis=0)), 6)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+"""
+test_eqingest.py: incremental ingest of a catalog that starts small
+Authors: Christopher Johnson
+
+Run with:  python3 -m pytest test_eqingest.py   (or python3 -m unittest)
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from eqingest import ASSIGNMENT_SUFFIX, STATS_RESOLUTION, ingest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def catalog_lines():
+    with open(os.path.join(HERE, "10k.csv"), "r", newline="") as fd:
+        return fd.readlines()
+
+
+class SmallFirstBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.catalog = os.path.join(self.work_dir, "catalog.csv")
+        self.lines = catalog_lines()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def append(self, lines):
+        with open(self.catalog, "a", newline="") as fd:
+            fd.writelines(lines)
+
+    def assignments(self):
+        with open(self.catalog + ASSIGNMENT_SUFFIX, "r") as fd:
+            return [line.split(",")[0] for line in fd]
+
+    def test_three_events_then_more(self):
+        # header and three events: fewer locations than clusters
+        self.append(self.lines[:4])
+        state, added, duplicates = ingest(self.catalog, 6, seed=1)
+        self.assertEqual(added, 3)
+        self.assertIsNone(state["centroids"])
+        self.assertEqual(len(state["pending"]), 3)
+        self.assertEqual(self.assignments(), [ ])
+
+        self.append(self.lines[4:501])
+        state, added, duplicates = ingest(self.catalog, 6, seed=1)
+        self.assertEqual(added, 497)
+        self.assertEqual(state["pending"], [ ])
+        self.assertTrue((state["counts"] > 0).all(), state["counts"])
+        self.assertEqual(len(np.unique(state["centroids"], axis=0)), 6)
+        ids = self.assignments()
+        self.assertEqual(len(ids), 500)
+        self.assertEqual(len(set(ids)), 500)
+
+    def test_one_location_first(self):
+        # the first events all share one location
+        first = self.lines[1]
+        fields = first.split(",")
+        copies = [",".join(["dup{}".format(number)] + fields[1:])
+                  for number in range(5)]
+        self.append([self.lines[0], first] + copies)
+        state, added, duplicates = ingest(self.catalog, 6, seed=1)
+        self.assertIsNone(state["centroids"])
+        self.append(self.lines[2:300])
+        state, added, duplicates = ingest(self.catalog, 6, seed=1)
+        self.assertTrue((state["counts"] > 0).all(), state["counts"])
+        self.assertEqual(len(np.unique(state["centroids"], axis=0)), 6)
+        self.assertEqual(len(self.assignments()), 304)
+
+
+class BoundedStatsTest(unittest.TestCase):
+
+    def test_frequency_tables_are_rounded(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            catalog = os.path.join(work_dir, "catalog.csv")
+            with open(catalog, "w", newline="") as fd:
+                fd.writelines(catalog_lines())
+            state, added, duplicates = ingest(catalog, 6, seed=1)
+        for stats in (state["mag_stats"], state["depth_stats"]):
+            steps = (stats.maximum - stats.minimum) / STATS_RESOLUTION
+            self.assertLessEqual(len(stats.counts), steps + 2)
+            self.assertEqual(sum(stats.counts.values()), added)
+
+
+if __name__ == "__main__":
+    unittest.main()